@@ -1,12 +1,18 @@
 from .flashcards.decks import router as decks_router
 from .flashcards.reviews import router as reviews_router
 from .flashcards.cards import router as cards_router
+from .flashcards.sync import router as sync_router
+from .flashcards.optimizer import router as optimizer_router
+from .flashcards.media import router as media_router
 from .ui import ui_router
 
 routers = [
     decks_router,
     reviews_router,
     cards_router,
+    sync_router,
+    optimizer_router,
+    media_router,
     ui_router
 ]
 
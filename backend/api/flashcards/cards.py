@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
-from services.flashcard import flashcard
-from schemas.card import Card as CardSchema
+from services.flashcard import Flashcard
+from schemas.card import Card as CardSchema, CardSelection, CardMove, DuplicateCheck
+from services.duplicates import Duplicates
 from core.logs import logger
 
 router = APIRouter(prefix="/flashcards/cards", tags=["cards"])
@@ -41,6 +42,66 @@ async def edit_card(card: CardSchema):
     logger.info(data)
     return Flashcard.save_card(data)
 
+@router.post("/duplicates/check")
+async def check_duplicates(candidate: DuplicateCheck):
+    """
+    Find cards duplicating the candidate question/answer, optionally within deck_id.
+    Pass card_id when editing so the card doesn't match itself.
+    """
+    return Duplicates.find(candidate.question, candidate.answer, candidate.deck_id, candidate.card_id)
+
+@router.get("/duplicates")
+async def list_duplicates(deck_id: int = None, page: int = 1):
+    """
+    Groups of exact duplicate cards in a deck or the whole collection: /duplicates?deck_id=1&page=1
+    """
+    return Duplicates.clusters({"deck_id": deck_id, "page": page})
+
+# Bulk routes are declared before the /{card_id} ones, "/bulk/trash" would match "/{card_id}/trash"
+
+def selection_filters(selection: CardSelection) -> dict:
+    return selection.model_dump(include={"card_ids", "deck_id", "search", "state", "is_trash"})
+
+@router.post("/bulk/move")
+async def move_cards(selection: CardMove):
+    """
+    Move the selected cards to target_deck_id. Select by card_ids and/or filters
+    (deck_id, search, state, is_trash), combined with AND.
+    """
+    try:
+        moved = Flashcard.move_cards(selection_filters(selection), selection.target_deck_id)
+        return {"moved": moved}
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/bulk/trash")
+async def trash_cards(selection: CardSelection):
+    """Trash the selected cards"""
+    try:
+        return {"trashed": Flashcard.trash_cards(selection_filters(selection))}
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/bulk/restore")
+async def restore_cards(selection: CardSelection):
+    """Restore the selected cards from trash"""
+    try:
+        return {"restored": Flashcard.restore_cards(selection_filters(selection))}
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/bulk/delete")
+async def delete_cards(selection: CardSelection):
+    """Delete the selected cards and their reviews"""
+    try:
+        return {"deleted": Flashcard.delete_cards(selection_filters(selection))}
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.delete("/{card_id}")
 async def delete_card(card_id: int):
     try:
@@ -64,4 +125,4 @@ async def trash_card(card_id: int):
         return {"trashed": res, "card_id": card_id}
     except Exception as e:
         logger.error(e)
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
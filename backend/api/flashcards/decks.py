@@ -16,7 +16,7 @@ async def save_deck(deck: DeckSchema):
     try:
         data = {
             "name": deck.name,
-            "author": deck.author or Config.get("author", "unknown"),
+            "author": deck.author or Config.settings.author,
             "id": deck.id,
         }
         return Flashcard.save_deck(data)
@@ -36,7 +36,7 @@ async def edit_deck(deck_id: int, deck: DeckSchema):
     data = {
         "id": deck_id,
         "name": deck.name,
-        "author": deck.author or Config.get("author", "unknown"),
+        "author": deck.author or Config.settings.author,
     }
     return Flashcard.save_deck(data)
 
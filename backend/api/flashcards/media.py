@@ -0,0 +1,65 @@
+import os
+from fastapi import APIRouter, HTTPException, Path, Request
+from fastapi.responses import FileResponse, Response
+from core.config import Config
+from core.tenancy import open_shard
+from db.database import use_tenant, TENANT_PATTERN
+from services.media import MediaStore, MediaTooLarge, HASH_PATTERN
+
+router = APIRouter(prefix="/flashcards/media", tags=["media"])
+
+# Content addressed: a url always serves the same bytes, clients keep them for a year.
+# Private, shards are per tenant; served media must never run as a page of this origin.
+MEDIA_HEADERS = {
+    "Cache-Control": "private, max-age=31536000, immutable",
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "default-src 'none'; sandbox",
+}
+
+@router.post("/", status_code=201)
+async def upload_media(request: Request):
+    """
+    Upload an image, audio or video as the raw request body with its Content-Type.
+    Returns its hash and url, reference the url in a card's question or answer.
+    Uploading the same content again returns the stored one.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if not MediaStore.allowed(content_type):
+        raise HTTPException(status_code=415, detail="Only image, audio and video media are accepted.")
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > Config.settings.media_max_size:
+        raise HTTPException(status_code=413, detail=f"Media is larger than {Config.settings.media_max_size} bytes.")
+
+    try:
+        return await MediaStore.store_stream(request.stream(), content_type)
+    except MediaTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@router.get("/{tenant}/{digest}")
+async def get_media(request: Request, tenant: str = Path(pattern=TENANT_PATTERN.pattern),
+                    digest: str = Path(pattern=HASH_PATTERN)):
+    """
+    Stream a media file of the tenant named in the url, browsers send no tenant header for <img src>.
+    With Range requests (seeking audio and video) and If-None-Match.
+    """
+    if not await open_shard(tenant):
+        raise HTTPException(status_code=404, detail="Media not found.")
+    with use_tenant(tenant):
+        return serve(request, digest)
+
+@router.get("/{digest}")
+async def get_media_of_header_tenant(request: Request, digest: str = Path(pattern=HASH_PATTERN)):
+    """Urls without a tenant, as stored before it was part of them: the tenant of the header"""
+    return serve(request, digest)
+
+def serve(request: Request, digest: str) -> Response:
+    media = MediaStore.get(digest)
+    if not media or not os.path.exists(MediaStore.path(digest)):
+        raise HTTPException(status_code=404, detail="Media not found.")
+
+    etag = f'"{digest}"'
+    headers = {**MEDIA_HEADERS, "ETag": etag}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    # Starlette answers Range requests and uses the server's zero-copy path send when offered
+    return FileResponse(MediaStore.path(digest), media_type=media.content_type, headers=headers)
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, BackgroundTasks, HTTPException
+from db.database import get_tenant
+from services.optimizer import Optimizer, MIN_REVIEWS
+
+router = APIRouter(prefix="/flashcards/optimizer", tags=["optimizer"])
+
+@router.get("/")
+async def get_parameters():
+    """
+    Fitted FSRS parameters in use with their log-loss and RMSE against the defaults,
+    and whether an optimizer job is running.
+    """
+    return {
+        "running": get_tenant() in Optimizer.running,
+        "parameters": Optimizer.get_parameters(),
+    }
+
+@router.post("/", status_code=202)
+async def run_optimizer(background_tasks: BackgroundTasks, per_deck: bool = True, min_reviews: int = MIN_REVIEWS):
+    """
+    Start fitting FSRS parameters on the review history: /optimizer?per_deck=true&min_reviews=1000
+    The job runs in the background, GET shows the result. Same as scripts/optimize.py.
+    One job runs at a time per server process, 503 while another tenant's job is running.
+    """
+    tenant = get_tenant()
+    if tenant in Optimizer.running:
+        raise HTTPException(status_code=409, detail="An optimizer job is already running.")
+    if min_reviews < 1:
+        raise HTTPException(status_code=400, detail="min_reviews must be at least 1.")
+    if not Optimizer.slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="The optimizer is busy with another job, retry later.")
+
+    Optimizer.running.add(tenant)
+    background_tasks.add_task(Optimizer.run_job, tenant, per_deck=per_deck, min_reviews=min_reviews)
+    return {"status": "started"}
@@ -1,23 +1,42 @@
 from schemas.cardreviewdue import CardReviewDue
 from core.logs import logger
-from fastapi import APIRouter, Body, HTTPException
-from services import flashcard
+from fastapi import APIRouter, Body, HTTPException, Query
+from typing import List, Optional
+from services.flashcard import Flashcard
+from services.spacedrepetition import SpacedRepetition
 
 router = APIRouter(prefix="/flashcards/reviews", tags=["reviews"])
 
 @router.get("/due")
 async def get_due_cards(page: int = None):
     page = page or 1
-    card_due = flashcard.get_due_cards({"page": page})
+    card_due = Flashcard.get_due_cards({"page": page})
     return card_due
 
+@router.get("/preview")
+async def preview_cards(card_id: List[int] = Query(...)):
+    """
+    Next due and interval for all four ratings, without saving: /preview?card_id=1&card_id=2
+    """
+    return SpacedRepetition().preview(card_id)
+
+@router.get("/preview/due")
+async def preview_due_cards(page: int = 1, deck_id: Optional[int] = None):
+    """
+    Rating previews for a page of due cards, same paging as /due
+    """
+    filters = {"page": page}
+    if deck_id:
+        filters["deck_id"] = deck_id
+    return Flashcard.preview_due_cards(filters)
+
 @router.post("/")
 async def review_card(carddue: CardReviewDue):
     """
     Learn a card for the first time, optionally with an initial rating.
     """
     print("card review", carddue.rating)
-    result = flashcard.get_next_due(carddue.card_id, carddue.rating)
+    result = Flashcard.get_next_due(carddue.card_id, carddue.rating)
     if result.get("error"):
         logger.error(result['error'])
         raise HTTPException(status_code=400, detail=result["error"])
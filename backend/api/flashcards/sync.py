@@ -0,0 +1,38 @@
+from datetime import timezone
+from fastapi import APIRouter, HTTPException
+from services.sync import Sync
+from services.spacedrepetition import SpacedRepetition
+from schemas.sync import SyncReviews
+from core.logs import logger
+
+router = APIRouter(prefix="/flashcards/sync", tags=["sync"])
+
+@router.get("/")
+async def get_changes(token: int = 0):
+    """
+    Get decks, cards, reviews and deletions changed since the sync token: /sync?token=42
+    Use the returned token for the next call, token 0 gives everything.
+    """
+    return Sync.get_changes(token)
+
+@router.post("/reviews")
+async def upload_reviews(payload: SyncReviews):
+    """
+    Apply reviews done offline. Uploading the same reviews again is a no-op.
+    Naive review_datetime values are taken as UTC.
+    """
+    reviews = []
+    for review in payload.reviews:
+        review_datetime = review.review_datetime
+        if review_datetime.tzinfo is None:
+            review_datetime = review_datetime.replace(tzinfo=timezone.utc)
+        reviews.append({
+            "card_id": review.card_id,
+            "rating": review.rating,
+            "review_datetime": review_datetime.astimezone(timezone.utc),
+        })
+    try:
+        return SpacedRepetition().apply_reviews(reviews)
+    except Exception as e:
+        logger.error(e)
+        raise HTTPException(status_code=400, detail=str(e))
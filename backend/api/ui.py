@@ -1,27 +1,83 @@
 from schemas.cardreviewdue import CardReviewDue
 from core.logs import logger
 from fastapi import APIRouter, Body, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from services.flashcard import Flashcard
-from fastapi.templating import Jinja2Templates
+from services.dueevents import due_events
+from services.sync import Sync
+from db.database import get_tenant
+from core.config import Config
+from core.rendercache import RenderCache
+from functools import lru_cache
+import json
+import time
 
 
 ui_router = APIRouter(prefix="/ui", tags=["reviews"])
-template = Jinja2Templates(directory="templates")
+PAGES = ["due.html", "index.html"]
+
+page_cache = RenderCache(Config.settings.ui_cache_size)
+
+# Comment line sent when nothing changed, keeps proxies from closing idle streams
+HEARTBEAT = 15
+
+
+@lru_cache(maxsize=1)
+def get_templates():
+    """
+    Jinja2 is imported and every page compiled on the first UI request rather than at startup,
+    API only workers never pay for it.
+    """
+    from fastapi.templating import Jinja2Templates
+
+    templates = Jinja2Templates(directory="templates")
+    # Templates only change on deploy, skip the mtime check on every render
+    templates.env.auto_reload = Config.settings.template_reload
+    for name in PAGES:
+        templates.get_template(name)
+    return templates
 
 
 @ui_router.get("/due", response_class=HTMLResponse)
-def due_page(request: Request):
-    page = request.query_params.get("page") or 1
-    decks = flashcard.get_due_decks({"page": page})
-    headings = ["Deck", "Count"]
-    logger.info(f"card dues {decks}")
-    return template.TemplateResponse(
-        "due.html", {"request": request, "title": "Card Due", "decks": decks, "headings": headings}
-    )
+def due_page(request: Request, page: int = 1):
+    # Any review or deck/card write bumps the usn, so the key changes with the data
+    # Due counts also change as time passes, a cached due page is reused for at most UI_DUE_CACHE_TTL seconds
+    key = (get_tenant(), "due", page, Sync.current_usn(), int(time.time() // Config.settings.ui_due_cache_ttl))
+
+    def render():
+        decks = Flashcard.get_due_decks({"page": page})
+        logger.debug(f"card dues {decks}")
+        headings = ["Deck", "Count"]
+        return get_templates().get_template("due.html").render(title="Card Due", decks=decks, headings=headings)
+
+    return page_cache.response(request, key, render, cache=not Config.settings.template_reload)
+
+@ui_router.get("/due/events")
+async def due_events_stream(request: Request):
+    """
+    Server-Sent Events of due counts: first every deck's count, then the counts of decks that changed.
+    Each event is `event: due` with data {deck_id: count}.
+    """
+    subscriber = await due_events.subscribe(get_tenant())
+
+    async def stream():
+        try:
+            yield f"event: due\ndata: {json.dumps(subscriber.counts)}\n\n"
+            while True:
+                changes = await subscriber.next(HEARTBEAT)
+                if changes:
+                    yield f"event: due\ndata: {json.dumps(changes)}\n\n"
+                else:
+                    yield ": ping\n\n"
+        finally:
+            due_events.unsubscribe(subscriber)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @ui_router.get("/", response_class=HTMLResponse)
 def home_page(request: Request):
-    return template.TemplateResponse(
-        "index.html", {"request": request, "title": "Home", "app_url": "http://localhost:8000"}
-    )
\ No newline at end of file
+    def render():
+        return get_templates().get_template("index.html").render(title="Home", app_url="http://localhost:8000")
+
+    # Edited templates show up on the next request while TEMPLATE_RELOAD is on
+    return page_cache.response(request, ("home",), render, max_age=300, cache=not Config.settings.template_reload)
\ No newline at end of file
@@ -1,16 +1,106 @@
+"""
+Settings
+
+The environment and .env are read once into an immutable, typed snapshot: Config.settings.
+Call Config.reload() to take a new snapshot, e.g. after editing .env. A reader holding the old
+snapshot keeps a consistent one.
+
+reload() only reaches values read at use time, Config.get() and most settings. Those applied
+once at startup need a restart: LOG_LOCATION and LOG_LEVEL (log sinks), DB_POOL_SIZE,
+UI_CACHE_SIZE, and TEMPLATE_RELOAD (read when the UI templates are first loaded).
+"""
+
+from dataclasses import dataclass, fields
 from dotenv import load_dotenv, find_dotenv
+import json
 import os
 
+
+@dataclass(frozen=True)
+class Settings:
+    author: str = "unknown"
+    log_location: str = "app.log"
+    log_level: str = "INFO"
+    db_pool_size: int = 32
+    tenant_header: str = "X-Tenant-ID"
+    near_duplicates: bool = False
+    duplicate_similarity: float = 0.7
+    template_reload: bool = False
+    ui_cache_size: int = 256
+    ui_due_cache_ttl: int = 30
+    media_dir: str = "media"
+    media_max_size: int = 20 * 1024 * 1024
+
+    def __post_init__(self):
+        if self.db_pool_size < 1:
+            raise ValueError("DB_POOL_SIZE must be at least 1.")
+        if not 0 < self.duplicate_similarity <= 1:
+            raise ValueError("DUPLICATE_SIMILARITY must be in (0, 1].")
+        if self.ui_cache_size < 1 or self.ui_due_cache_ttl < 1:
+            raise ValueError("UI_CACHE_SIZE and UI_DUE_CACHE_TTL must be at least 1.")
+        if self.media_max_size < 1:
+            raise ValueError("MEDIA_MAX_SIZE must be at least 1.")
+
+    @classmethod
+    def from_env(cls, env: dict) -> "Settings":
+        """
+        Build the settings from environment values, keys are the upper case field names
+        Raises:
+            ValueError: If a value doesn't match its field type or is out of range
+        """
+        values = {}
+        for field in fields(cls):
+            raw = env.get(field.name.upper())
+            if raw is not None:
+                values[field.name] = cls.parse(field.name, field.type, raw)
+        return cls(**values)
+
+    @staticmethod
+    def parse(name: str, type_: type, raw: str):
+        if type_ is bool:
+            if raw.lower() in ("true", "1", "yes", "on"):
+                return True
+            if raw.lower() in ("false", "0", "no", "off", ""):
+                return False
+            raise ValueError(f"{name.upper()} must be true or false, got '{raw}'.")
+        try:
+            return type_(raw)
+        except ValueError as e:
+            raise ValueError(f"{name.upper()} must be {type_.__name__}, got '{raw}'.") from e
+
+
 class Config:
     config = None
 
     def __init__(self):
+        self.reload()
+
+    def reload(self) -> Settings:
+        """Re-read .env and the environment into a new snapshot"""
         load_dotenv(find_dotenv(usecwd=True), override=True)
-    
+        env = dict(os.environ)
+        # Settings, raw environment and the cast values of keys outside Settings (filled on first get)
+        # are swapped in one assignment: a get() racing a reload never caches an old value in the new snapshot
+        self.snapshot = (Settings.from_env(env), env, {})
+        return self.settings
+
+    @property
+    def settings(self) -> Settings:
+        return self.snapshot[0]
+
     def get(self, key: str, default = None):
+        """Value of any key: typed from the snapshot for Settings fields, cast once otherwise"""
+        settings, env, values = self.snapshot
+        name = key.lower()
+        if name in Settings.__dataclass_fields__:
+            return getattr(settings, name)
+
         key = key.upper()
-        value = os.getenv(key, default)
-        return self.cast_value(value)
+        if key not in env:
+            return self.cast_value(default)
+        if key not in values:
+            values[key] = self.cast_value(env[key])
+        return values[key]
 
     def cast_value(self, value):
         if type(value) == str:
@@ -32,7 +122,6 @@ class Config:
 
                 # If it is a json string, then parse it to json object
                 try:
-                    import json
                     json_value = json.loads(value)
                     value = json_value
                 except (TypeError, ValueError):
@@ -40,4 +129,4 @@ class Config:
         
         return value
 
-Config = Config()
\ No newline at end of file
+Config = Config()
@@ -3,8 +3,8 @@ from loguru import logger
 import sys
 
 # Get log file location and log level from config or set default
-log_file = Config.get("LOG_LOCATION", "app.log")
-log_level = Config.get("LOG_LEVEL", "INFO")
+log_file = Config.settings.log_location
+log_level = Config.settings.log_level
 
 logger.remove()
 
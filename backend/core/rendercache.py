@@ -0,0 +1,72 @@
+"""
+Rendered page cache
+
+Keeps rendered UI pages keyed by everything they depend on: tenant, page, query params and a
+data version. A write changes the version, so stale pages are never served and simply age out
+of the LRU. Each entry keeps its gzip body and ETag, a hit costs no rendering, no query beyond
+the version lookup and no compression; a matching If-None-Match costs no body on the wire.
+The ETag is a hash of the body, so a page changed by a template edit (and a restart) gets a new one.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Callable
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+class CachedPage:
+    def __init__(self, body: bytes):
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=6)
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.last_modified = formatdate(usegmt=True)
+
+
+class RenderCache:
+    """LRU of rendered pages"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_or_render(self, key: tuple, render: Callable[[], str]) -> CachedPage:
+        with self.lock:
+            page = self.pages.get(key)
+            if page:
+                self.pages.move_to_end(key)
+                return page
+
+        # Rendered outside the lock, two concurrent misses both render the same page
+        page = CachedPage(render().encode())
+        with self.lock:
+            self.pages[key] = page
+            while len(self.pages) > self.max_entries:
+                self.pages.popitem(last=False)
+        return page
+
+    def response(self, request: Request, key: tuple, render: Callable[[], str], max_age: int = 0,
+                 cache: bool = True) -> Response:
+        """
+        Cached page as a response: 304 when the client has it, gzip when accepted
+        Args:
+            request (Request): Incoming request, for If-None-Match and Accept-Encoding
+            key (tuple): Everything the page depends on
+            render (Callable): Renders the page on a miss
+            max_age (int): Seconds the browser may reuse the page without asking
+            cache (bool): False to render on every request, e.g. while templates are edited
+        """
+        page = self.get_or_render(key, render) if cache else CachedPage(render().encode())
+        headers = {"ETag": page.etag, "Cache-Control": f"private, max-age={max_age}", "Vary": "Accept-Encoding"}
+        if page.etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        headers["Last-Modified"] = page.last_modified
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            return Response(page.gzip_body, media_type="text/html", headers=headers)
+        return Response(page.body, media_type="text/html", headers=headers)
@@ -0,0 +1,49 @@
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from core.config import Config
+from db.database import pool, use_tenant, DEFAULT_TENANT
+
+async def open_shard(tenant: str, create: bool = False) -> bool:
+    """
+    Open the tenant's shard if it's not in the pool yet, off the event loop: opening sets up its schema.
+    Args:
+        tenant (str): Tenant id
+        create (bool): Create the shard when it has no file yet
+    Returns:
+        bool: False if the tenant has no shard (and create is off)
+    Raises:
+        ValueError: If the tenant id is invalid
+    """
+    if not create and not pool.exists(tenant):
+        return False
+    if not pool.is_open(tenant):
+        await run_in_threadpool(pool.get, tenant)
+    return True
+
+class TenantMiddleware:
+    """
+    Bind the shard of the requesting tenant for the whole request.
+    The tenant is read from the header named by TENANT_HEADER config (default X-Tenant-ID),
+    requests without it use the default shard. Requests only open existing shards, new tenants
+    are created with scripts/setup.py.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        header = Config.settings.tenant_header.lower().encode()
+        tenant = dict(scope["headers"]).get(header, b"").decode() or DEFAULT_TENANT
+        try:
+            if not await open_shard(tenant, create=tenant == DEFAULT_TENANT):
+                response = JSONResponse({"detail": f"Unknown tenant '{tenant}'."}, status_code=404)
+                return await response(scope, receive, send)
+        except ValueError as e:
+            response = JSONResponse({"detail": str(e)}, status_code=400)
+            return await response(scope, receive, send)
+
+        with use_tenant(tenant):
+            await self.app(scope, receive, send)
@@ -1,14 +1,237 @@
-from peewee import Model, SqliteDatabase
+"""
+Database shards
 
-db = SqliteDatabase("db/velocity.db", pragmas={'journal_mode': 'wal'})
+Every tenant gets its own SQLite file: db/<tenant>.db. Models are bound to `db`, a proxy that
+resolves to the shard of the tenant bound to the current context (request), or to the default
+shard db/velocity.db when none is bound. Open shards are kept in a bounded LRU pool. The first
+time a shard is opened by the process, its missing tables, columns and indexes are created; the
+backfills of pending migrations then run in a background thread while requests are served.
+migrate_on_open turns both off (scripts/dbmigration.py runs the migrations itself).
+
+peewee keeps one connection per thread and database, an evicted shard closes the connections of
+every thread once the last context using it is done.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from peewee import Model, SqliteDatabase, DatabaseProxy
+from core.config import Config
+
+DB_DIR = "db"
+DEFAULT_TENANT = "velocity"
+PRAGMAS = {'journal_mode': 'wal'}
+TENANT_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+current_database: ContextVar[Optional["ShardDatabase"]] = ContextVar("current_database", default=None)
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default=DEFAULT_TENANT)
+
+
+class ShardDatabase(SqliteDatabase):
+    """SqliteDatabase keeping track of the connection each thread opened, so they can all be closed."""
+
+    def __init__(self, *args, **kwargs):
+        # Connections stay per thread, this only lets close_connections() close them from another one
+        super().__init__(*args, check_same_thread=False, **kwargs)
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+        self.users = 0
+        self.evicted = False
+
+    def _connect(self):
+        connection = super()._connect()
+        with self.connections_lock:
+            self.connections.add(connection)
+        return connection
+
+    def _close(self, conn):
+        with self.connections_lock:
+            self.connections.discard(conn)
+        super()._close(conn)
+
+    def close_connections(self) -> None:
+        """Close the connection of every thread, the database must not be in use"""
+        with self.connections_lock:
+            connections, self.connections = self.connections, set()
+        for connection in connections:
+            connection.close()
+
+
+class ShardPool:
+    """Bounded LRU pool of open shard databases, keyed by tenant."""
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max(1, max_size)
+        self.migrate_on_open = True
+        self.databases = OrderedDict()
+        self.opening = {}
+        # Tenants with a background migration running in this process
+        self.migrating = set()
+        self.lock = threading.RLock()
+
+    def path(self, tenant: str) -> str:
+        """
+        File of the tenant's shard
+        Raises:
+            ValueError: If the tenant id is not a safe file name
+        """
+        if not tenant or not TENANT_PATTERN.match(tenant):
+            raise ValueError(f"Invalid tenant '{tenant}'.")
+        return os.path.join(self.directory, f"{tenant}.db")
+
+    def exists(self, tenant: str) -> bool:
+        """Whether the tenant's shard file exists, or is open"""
+        return tenant in self.databases or os.path.exists(self.path(tenant))
+
+    def is_open(self, tenant: str) -> bool:
+        return tenant in self.databases
+
+    def get(self, tenant: str) -> ShardDatabase:
+        """
+        Get the tenant's shard, opening and preparing it if it's not in the pool.
+        The pool lock is not held while a shard is prepared, only other openers of the same
+        tenant wait for it. The least recently used shard is evicted when the pool is full.
+        """
+        with self.lock:
+            database = self.databases.get(tenant)
+            if database is not None:
+                self.databases.move_to_end(tenant)
+                return database
+            opening = self.opening.setdefault(tenant, threading.Lock())
+
+        with opening:
+            with self.lock:
+                database = self.databases.get(tenant)
+                if database is not None:
+                    self.databases.move_to_end(tenant)
+                    return database
+
+            database = ShardDatabase(self.path(tenant), pragmas=PRAGMAS)
+            pending = self.setup(database)
+
+            with self.lock:
+                self.databases[tenant] = database
+                self.opening.pop(tenant, None)
+                while len(self.databases) > self.max_size:
+                    _, evicted = self.databases.popitem(last=False)
+                    evicted.evicted = True
+                    if not evicted.users:
+                        evicted.close_connections()
+                if pending and tenant not in self.migrating:
+                    self.migrating.add(tenant)
+                    threading.Thread(target=self.migrate, args=(tenant,), name=f"migrate-{tenant}", daemon=True).start()
+            return database
+
+    def acquire(self, tenant: str) -> ShardDatabase:
+        """Get the tenant's shard and keep its connections open until release()"""
+        while True:
+            database = self.get(tenant)
+            with self.lock:
+                # Evicted between get() and here, its connections may be closed already
+                if not database.evicted:
+                    database.users += 1
+                    return database
+
+    def release(self, database: ShardDatabase) -> None:
+        """Close an evicted shard's connections once its last user is done"""
+        with self.lock:
+            database.users -= 1
+            if database.evicted and not database.users:
+                database.close_connections()
+
+    def setup(self, database: ShardDatabase) -> bool:
+        """
+        Create missing tables, columns and indexes on a newly opened shard
+        Returns:
+            bool: Whether migrations with backfills are pending
+        """
+        # Imported here, db.schema imports the models which import this module
+        from db.schema import setup_schema
+
+        token = current_database.set(database)
+        try:
+            with database.connection_context():
+                return setup_schema(migrate=self.migrate_on_open)
+        finally:
+            current_database.reset(token)
+
+    def migrate(self, tenant: str) -> None:
+        """Background thread applying the tenant's pending migrations, backfills included"""
+        from db.schema import migrate_schema
+
+        try:
+            with use_tenant(tenant):
+                with current_database.get().connection_context():
+                    migrate_schema()
+        finally:
+            with self.lock:
+                self.migrating.discard(tenant)
+
+    def tenants(self) -> list:
+        """Tenants having a shard file on disk"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[:-3] for name in os.listdir(self.directory)
+            if name.endswith(".db") and TENANT_PATTERN.match(name[:-3])
+        )
+
+    def close_all(self) -> None:
+        with self.lock:
+            for database in self.databases.values():
+                database.close_connections()
+            self.databases.clear()
+
+
+class ShardProxy(DatabaseProxy):
+    """Database proxy resolving to the shard bound to the current context."""
+
+    def __init__(self):
+        self._callbacks = []
+
+    @property
+    def obj(self):
+        return current_database.get() or pool.get(DEFAULT_TENANT)
+
+
+pool = ShardPool(DB_DIR, Config.settings.db_pool_size)
+db = ShardProxy()
 
 class BaseModel(Model):
     class Meta:
         database = db
 
 
+@contextmanager
+def use_tenant(tenant: Optional[str] = None):
+    """
+    Bind the tenant's shard to the current context, models read and write it inside the block.
+    Args:
+        tenant (Optional[str]): Tenant id, the default shard when empty
+    """
+    tenant = tenant or DEFAULT_TENANT
+    database = pool.acquire(tenant)
+    token = current_database.set(database)
+    tenant_token = current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        current_tenant.reset(tenant_token)
+        current_database.reset(token)
+        pool.release(database)
+
+def get_tenant() -> str:
+    """Tenant bound to the current context"""
+    return current_tenant.get()
+
+
 def connect():
     db.connect()
 
 def disconnect():
-    db.close()
\ No newline at end of file
+    db.close()
@@ -0,0 +1,406 @@
+"""
+Versioned migrations
+
+Each Migration is a version number, a name and a list of steps. Applied versions are recorded
+in the migrationhistory table, so a runner only executes what is pending. Steps are built to
+run against a live database:
+
+- AddColumn uses a plain ALTER TABLE ADD COLUMN with a constant default, which SQLite applies
+  without rewriting the table.
+- Backfill updates rows in primary key chunks, one short transaction per chunk, sleeping
+  between chunks. Progress (step and cursor) is saved with every chunk, an interrupted
+  migration resumes at the step and row where it stopped.
+- Transform is a Backfill for values computed in Python, e.g. hashes.
+- AddIndex is a single CREATE INDEX: SQLite can't build an index incrementally, so it is kept
+  as its own step to hold the write lock only for the build.
+
+Downgrades run the reverse of each step in reverse order, backfills have no reverse.
+
+upgrade_schema() runs only the steps that don't walk the rows (columns, indexes), so a shard
+opened by a request gets the schema the code expects right away; the chunked steps are left to
+upgrade().
+"""
+
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from peewee import IntegrityError, OperationalError
+from db.database import db
+from models.migrationhistory import MigrationHistory
+
+# A running migration not heard from for this long is considered crashed and can be taken over
+LEASE = timedelta(minutes=5)
+
+
+class MigrationLocked(Exception):
+    """Another runner is applying the migration."""
+
+
+class Step(ABC):
+    """One unit of a migration."""
+
+    # Walks the rows in chunks, too long to run while a request waits
+    chunked = False
+
+    @abstractmethod
+    def apply(self, runner: "MigrationRunner", history: Optional[MigrationHistory]) -> None:
+        """Run the step, history.cursor is the step's progress (None when reverting)"""
+
+    def reverse(self) -> Optional["Step"]:
+        return None
+
+    @abstractmethod
+    def describe(self) -> str:
+        """One line description for logs and plans"""
+
+
+class Sql(Step):
+    def __init__(self, sql: str, reverse_sql: Optional[str] = None):
+        self.sql = sql
+        self.reverse_sql = reverse_sql
+
+    def apply(self, runner, history):
+        db.execute_sql(self.sql)
+
+    def reverse(self):
+        return Sql(self.reverse_sql) if self.reverse_sql else None
+
+    def describe(self):
+        return self.sql
+
+
+class AddColumn(Step):
+    def __init__(self, table: str, column: str, definition: str):
+        self.table = table
+        self.column = column
+        self.definition = definition
+
+    def apply(self, runner, history):
+        if self.column not in [c.name for c in db.get_columns(self.table)]:
+            db.execute_sql(f'ALTER TABLE "{self.table}" ADD COLUMN "{self.column}" {self.definition}')
+
+    def reverse(self):
+        return DropColumn(self.table, self.column)
+
+    def describe(self):
+        return f"add column {self.table}.{self.column} {self.definition}"
+
+
+class DropColumn(Step):
+    def __init__(self, table: str, column: str):
+        self.table = table
+        self.column = column
+
+    def apply(self, runner, history):
+        if self.column in [c.name for c in db.get_columns(self.table)]:
+            db.execute_sql(f'ALTER TABLE "{self.table}" DROP COLUMN "{self.column}"')
+
+    def describe(self):
+        return f"drop column {self.table}.{self.column}"
+
+
+class AddIndex(Step):
+    def __init__(self, table: str, columns: list, unique: bool = False):
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+        self.name = f"{table}_{'_'.join(columns)}"
+
+    def apply(self, runner, history):
+        unique = "UNIQUE " if self.unique else ""
+        columns = ", ".join(f'"{c}"' for c in self.columns)
+        db.execute_sql(f'CREATE {unique}INDEX IF NOT EXISTS "{self.name}" ON "{self.table}" ({columns})')
+
+    def reverse(self):
+        return Sql(f'DROP INDEX IF EXISTS "{self.name}"')
+
+    def describe(self):
+        return f"add index {self.name}"
+
+
+class Backfill(Step):
+    """
+    Chunked UPDATE of the rows matching `where`.
+    Args:
+        table (str): Table to update, must have an integer id primary key
+        assignments (str): SET clause, e.g. "modifiedtime = createdtime"
+        where (str): Condition selecting the rows that still need the update
+    """
+
+    chunked = True
+
+    def __init__(self, table: str, assignments: str, where: str):
+        self.table = table
+        self.assignments = assignments
+        self.where = where
+
+    def remaining(self, cursor: int = 0) -> int:
+        """Rows left to update, all rows while the columns it reads are yet to be added"""
+        try:
+            return db.execute_sql(
+                f'SELECT COUNT(*) FROM "{self.table}" WHERE id > ? AND ({self.where})', (cursor,)
+            ).fetchone()[0]
+        except OperationalError:
+            return db.execute_sql(f'SELECT COUNT(*) FROM "{self.table}" WHERE id > ?', (cursor,)).fetchone()[0]
+
+    def apply(self, runner, history):
+        # Nothing to do, avoids walking every chunk of a big table
+        pending = db.execute_sql(
+            f'SELECT 1 FROM "{self.table}" WHERE id > ? AND ({self.where}) LIMIT 1', (history.cursor,)
+        ).fetchone()
+
+        while pending:
+            upper = db.execute_sql(
+                f'SELECT MAX(id) FROM (SELECT id FROM "{self.table}" WHERE id > ? ORDER BY id LIMIT ?)',
+                (history.cursor, runner.chunk_size),
+            ).fetchone()[0]
+            if upper is None:
+                break
+
+            with db.atomic():
+                updated = db.execute_sql(
+                    f'UPDATE "{self.table}" SET {self.assignments} WHERE id > ? AND id <= ? AND ({self.where})',
+                    (history.cursor, upper),
+                ).rowcount
+                history.cursor = upper
+                history.updatedtime = datetime.now()
+                history.save()
+            runner.log(f"  {self.table}: {updated} rows updated up to id {upper}")
+
+            if runner.throttle:
+                time.sleep(runner.throttle)
+
+    def describe(self):
+        return f"backfill {self.table} set {self.assignments} where {self.where}"
+
+
+class Transform(Step):
+    """
+    Chunked rewrite of the rows matching `where` with values computed in Python.
+    Args:
+        table (str): Table to update, must have an integer id primary key
+        columns (list): Columns read and passed to function
+        function (Callable): Takes a row dict of columns, returns a dict of columns to set
+        where (str): Condition selecting the rows that still need the update
+    """
+
+    chunked = True
+
+    def __init__(self, table: str, columns: list, function: Callable, where: str):
+        self.table = table
+        self.columns = columns
+        self.function = function
+        self.where = where
+
+    def remaining(self, cursor: int = 0) -> int:
+        return Backfill(self.table, "", self.where).remaining(cursor)
+
+    def apply(self, runner, history):
+        columns = ", ".join(f'"{c}"' for c in self.columns)
+        while True:
+            rows = db.execute_sql(
+                f'SELECT id, {columns} FROM "{self.table}" WHERE id > ? AND ({self.where}) ORDER BY id LIMIT ?',
+                (history.cursor, runner.chunk_size),
+            ).fetchall()
+            if not rows:
+                break
+
+            with db.atomic():
+                for row in rows:
+                    values = self.function(dict(zip(self.columns, row[1:])))
+                    assignments = ", ".join(f'"{c}" = ?' for c in values)
+                    db.execute_sql(
+                        f'UPDATE "{self.table}" SET {assignments} WHERE id = ?', (*values.values(), row[0])
+                    )
+                history.cursor = rows[-1][0]
+                history.updatedtime = datetime.now()
+                history.save()
+            runner.log(f"  {self.table}: {len(rows)} rows updated up to id {history.cursor}")
+
+            if runner.throttle:
+                time.sleep(runner.throttle)
+
+    def describe(self):
+        return f"transform {self.table} {', '.join(self.columns)} where {self.where}"
+
+
+class Migration:
+    def __init__(self, version: int, name: str, steps: list):
+        self.version = version
+        self.name = name
+        self.steps = steps
+
+    def reverse_steps(self) -> list:
+        steps = [step.reverse() for step in reversed(self.steps)]
+        return [step for step in steps if step]
+
+
+class MigrationRunner:
+    """
+    Applies or reverts versioned migrations on the database bound to the current context.
+    Args:
+        migrations (list): All migrations, any order
+        chunk_size (int): Rows per backfill transaction
+        throttle (float): Seconds to sleep between backfill chunks
+        dry_run (bool): Only log what would run
+        log (Callable): Output function
+    """
+
+    def __init__(self, migrations: list, chunk_size: int = 1000, throttle: float = 0.0,
+                 dry_run: bool = False, log: Callable = print):
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+        self.dry_run = dry_run
+        self.log = log
+
+    def applied(self) -> set:
+        if not MigrationHistory.table_exists():
+            return set()
+        query = MigrationHistory.select(MigrationHistory.version).where(MigrationHistory.status == "applied")
+        return {row.version for row in query}
+
+    def pending(self, target: Optional[int] = None) -> list:
+        applied = self.applied()
+        return [
+            m for m in self.migrations
+            if m.version not in applied and (target is None or m.version <= target)
+        ]
+
+    def plan(self, target: Optional[int] = None) -> list:
+        """
+        Pending migrations and their steps, with rows left per backfill
+        Returns:
+            list: One dict per pending migration
+        """
+        tables = db.get_tables()
+        plan = []
+        for migration in self.pending(target):
+            steps = []
+            for step in migration.steps:
+                description = step.describe()
+                if isinstance(step, (Backfill, Transform)) and step.table in tables:
+                    description += f" ({step.remaining()} rows)"
+                steps.append(description)
+            plan.append({"version": migration.version, "name": migration.name, "steps": steps})
+        return plan
+
+    def prepare_history(self) -> None:
+        """Create the history table, or add the step column to one created before it existed"""
+        MigrationHistory.create_table()
+        if "step" not in [c.name for c in db.get_columns(MigrationHistory._meta.table_name)]:
+            db.execute_sql(
+                f'ALTER TABLE "{MigrationHistory._meta.table_name}" ADD COLUMN "step" INTEGER NOT NULL DEFAULT 0'
+            )
+
+    def baseline(self) -> None:
+        """Record every migration as applied, for a database created from the current models"""
+        MigrationHistory.create_table()
+        now = datetime.now()
+        rows = [
+            {"version": m.version, "name": m.name, "status": "applied", "updatedtime": now, "appliedtime": now}
+            for m in self.migrations
+        ]
+        if rows:
+            MigrationHistory.insert_many(rows).on_conflict_ignore().execute()
+
+    def claim(self, migration: Migration) -> MigrationHistory:
+        """
+        Mark the migration running, or take over a crashed run keeping its step and cursor.
+        Raises:
+            MigrationLocked: If another runner is on it
+        """
+        with db.atomic():
+            history = MigrationHistory.get_or_none(MigrationHistory.version == migration.version)
+            if history and history.updatedtime > datetime.now() - LEASE:
+                raise MigrationLocked(f"Migration {migration.version} is being applied by another runner.")
+            if not history:
+                try:
+                    return MigrationHistory.create(version=migration.version, name=migration.name)
+                except IntegrityError as e:
+                    raise MigrationLocked(f"Migration {migration.version} is being applied by another runner.") from e
+            history.updatedtime = datetime.now()
+            history.save()
+            return history
+
+    def upgrade(self, target: Optional[int] = None) -> list:
+        """
+        Apply pending migrations up to target (all by default), in version order.
+        Returns:
+            list: Versions applied
+        Raises:
+            MigrationLocked: If another runner is applying one of them
+        """
+        done = []
+        for migration in self.pending(target):
+            self.log(f"Applying {migration.version} {migration.name}")
+            if self.dry_run:
+                for step in migration.steps:
+                    self.log(f"  {step.describe()}")
+                continue
+
+            self.prepare_history()
+            history = self.claim(migration)
+            for index, step in enumerate(migration.steps):
+                if index < history.step:
+                    # Finished before the run was interrupted
+                    continue
+                self.log(f"  {step.describe()}")
+                step.apply(self, history)
+                history.step, history.cursor = index + 1, 0
+                history.updatedtime = datetime.now()
+                history.save()
+            history.status = "applied"
+            history.appliedtime = history.updatedtime = datetime.now()
+            history.save()
+            done.append(migration.version)
+        return done
+
+    def upgrade_schema(self) -> list:
+        """
+        Apply the steps of pending migrations that aren't chunked, in version order. These are
+        idempotent, upgrade() runs them again. A migration made only of such steps is recorded
+        as applied, the others stay pending.
+        Returns:
+            list: Versions applied
+        """
+        done = []
+        for migration in self.pending():
+            steps = [step for step in migration.steps if not step.chunked]
+            for step in steps:
+                self.log(f"  {step.describe()}")
+                if not self.dry_run:
+                    step.apply(self, None)
+            if len(steps) < len(migration.steps) or self.dry_run:
+                continue
+
+            self.prepare_history()
+            now = datetime.now()
+            # Ignored when another runner has claimed it, that runner records it
+            MigrationHistory.insert(
+                version=migration.version, name=migration.name, status="applied", updatedtime=now, appliedtime=now,
+            ).on_conflict_ignore().execute()
+            done.append(migration.version)
+        return done
+
+    def downgrade(self, target: int) -> list:
+        """
+        Revert applied migrations above target, newest first.
+        Returns:
+            list: Versions reverted
+        """
+        applied = self.applied()
+        done = []
+        for migration in reversed(self.migrations):
+            if migration.version <= target or migration.version not in applied:
+                continue
+            self.log(f"Reverting {migration.version} {migration.name}")
+            for step in migration.reverse_steps():
+                self.log(f"  {step.describe()}")
+                if not self.dry_run:
+                    step.apply(self, None)
+            if not self.dry_run:
+                MigrationHistory.delete().where(MigrationHistory.version == migration.version).execute()
+            done.append(migration.version)
+        return done
@@ -0,0 +1,104 @@
+"""Schema setup and migrations, applied to the shard bound to the current context"""
+
+from core.logs import logger
+from db.database import db
+from db.migrations import Migration, MigrationRunner, MigrationLocked, AddColumn, AddIndex, Backfill, Transform
+from models.deck import Deck
+from models.card import Card
+from models.cardreview import CardReview
+from models.syncsequence import SyncSequence
+from models.tombstone import Tombstone
+from models.migrationhistory import MigrationHistory
+from models.cardbucket import CardBucket
+from models.reviewlog import ReviewLog
+from models.schedulerparameters import SchedulerParameters
+from models.media import Media
+from models.cardmedia import CardMedia
+from services.duplicates import Duplicates
+
+# Seconds between backfill chunks of the background migration, leaves the write lock to requests
+OPEN_THROTTLE = 0.05
+
+MODELS = [
+    Deck, Card, CardReview, SyncSequence, Tombstone, MigrationHistory, CardBucket,
+    ReviewLog, SchedulerParameters, Media, CardMedia,
+]
+
+# Append only, a released version must never change
+MIGRATIONS = [
+    Migration(1, "trash flags and card timestamps", [
+        AddColumn("deck", "is_trash", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("card", "createdtime", "DATETIME"),
+        AddColumn("card", "modifiedtime", "DATETIME"),
+        AddColumn("card", "is_trash", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("cardreview", "step", "INTEGER"),
+    ]),
+    Migration(2, "backfill card timestamps", [
+        Backfill("card", "createdtime = datetime('now', 'localtime')", "createdtime IS NULL"),
+        Backfill("card", "modifiedtime = createdtime", "modifiedtime IS NULL"),
+    ]),
+    Migration(3, "sync usn", [
+        AddColumn("deck", "usn", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("card", "usn", "INTEGER NOT NULL DEFAULT 0"),
+        AddColumn("cardreview", "usn", "INTEGER NOT NULL DEFAULT 0"),
+        AddIndex("deck", ["usn"]),
+        AddIndex("card", ["usn"]),
+        AddIndex("cardreview", ["usn"]),
+    ]),
+    Migration(4, "card fingerprint", [
+        AddColumn("card", "fingerprint", "VARCHAR(40)"),
+        Transform(
+            "card", ["question", "answer"],
+            lambda row: {"fingerprint": Duplicates.fingerprint(row["question"], row["answer"])},
+            "fingerprint IS NULL",
+        ),
+        AddIndex("card", ["fingerprint"]),
+    ]),
+    Migration(5, "fingerprint media sources", [
+        Transform(
+            "card", ["question", "answer"],
+            lambda row: {"fingerprint": Duplicates.fingerprint(row["question"], row["answer"])},
+            "question LIKE '%src%' OR answer LIKE '%src%'",
+        ),
+    ]),
+]
+
+
+def create_schema():
+    """Create the tables that don't exist yet, existing ones are left to the migrations"""
+    db.create_tables([model for model in MODELS if not model.table_exists()])
+
+def setup_schema(migrate: bool = True) -> bool:
+    """
+    Prepare the shard: a new one gets the current schema with every migration recorded as applied,
+    an existing one gets its missing tables and, if migrate, the columns and indexes of its pending
+    migrations, in one transaction. Backfills are left to migrate_schema().
+    Returns:
+        bool: Whether migrations are still pending
+    """
+    runner = MigrationRunner(MIGRATIONS, log=logger.info)
+    with db.atomic():
+        if not Deck.table_exists():
+            create_schema()
+            runner.baseline()
+            return False
+        if not migrate:
+            return False
+        create_schema()
+        runner.upgrade_schema()
+    return bool(runner.pending())
+
+def migrate_schema():
+    """
+    Apply the pending migrations, backfills included. Run outside any transaction: each backfill
+    chunk and its progress commit on their own, the API keeps serving the shard meanwhile.
+    """
+    runner = MigrationRunner(MIGRATIONS, throttle=OPEN_THROTTLE, log=logger.info)
+    try:
+        runner.upgrade()
+    except MigrationLocked as e:
+        # Left to the runner holding it, e.g. scripts/dbmigration.py backfilling a big shard
+        logger.warning(e)
+    except Exception as e:
+        # Resumed from its cursor the next time the shard is opened
+        logger.error(f"Migration failed: {e}")
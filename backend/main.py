@@ -1,8 +1,10 @@
 from core.logs import logger
 from fastapi import FastAPI
+from core.tenancy import TenantMiddleware
 import api
 
 app = FastAPI()
+app.add_middleware(TenantMiddleware)
 
 api.attach_router(app)
 
@@ -1,4 +1,4 @@
-from peewee import ForeignKeyField, TextField, DateTimeField, BooleanField
+from peewee import ForeignKeyField, TextField, DateTimeField, BooleanField, IntegerField, CharField
 from db.database import BaseModel
 from datetime import datetime
 from models.deck import Deck
@@ -10,3 +10,5 @@ class Card(BaseModel):
     createdtime = DateTimeField(default=datetime.now)
     modifiedtime = DateTimeField()
     is_trash = BooleanField(default=False)
+    usn = IntegerField(default=0, index=True)
+    fingerprint = CharField(max_length=40, null=True, index=True)
@@ -0,0 +1,12 @@
+from peewee import ForeignKeyField, CharField
+from db.database import BaseModel
+from models.card import Card
+
+"""
+MinHash LSH buckets of a card, for near-duplicate lookup.
+bucket: "<band>:<hash of the band's signature rows>", cards sharing a bucket are near-duplicate candidates
+"""
+
+class CardBucket(BaseModel):
+    card = ForeignKeyField(Card, backref='buckets')
+    bucket = CharField(index=True)
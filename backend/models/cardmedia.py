@@ -0,0 +1,12 @@
+from peewee import ForeignKeyField, CharField
+from db.database import BaseModel
+from models.card import Card
+
+"""
+Media referenced by a card, parsed from /flashcards/media/<tenant>/<hash> urls in its question and answer.
+A blob no card references is garbage collected.
+"""
+
+class CardMedia(BaseModel):
+    card = ForeignKeyField(Card, backref='media')
+    hash = CharField(max_length=64, index=True)
@@ -22,4 +22,5 @@ class CardReview(BaseModel):
     stability = FloatField()
     difficulty = FloatField()
     due = DateTimeField()
-    last_review = DateTimeField()
\ No newline at end of file
+    last_review = DateTimeField()
+    usn = IntegerField(default=0, index=True)
\ No newline at end of file
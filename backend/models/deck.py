@@ -1,4 +1,4 @@
-from peewee import BooleanField, CharField, DateTimeField
+from peewee import BooleanField, CharField, DateTimeField, IntegerField
 from db.database import BaseModel
 from datetime import datetime
 
@@ -7,4 +7,5 @@ class Deck(BaseModel):
     author = CharField()
     createdtime = DateTimeField(default=datetime.now)
     modifiedtime = DateTimeField()
-    is_trash = BooleanField(default=False)
\ No newline at end of file
+    is_trash = BooleanField(default=False)
+    usn = IntegerField(default=0, index=True)
\ No newline at end of file
@@ -0,0 +1,16 @@
+from peewee import CharField, DateTimeField, IntegerField
+from db.database import BaseModel
+from datetime import datetime
+
+"""
+Media blobs of the shard, the bytes are on disk under MEDIA_DIR/<tenant>/<hash[:2]>/<hash>.
+hash: sha256 of the content, the same content uploaded twice is stored once
+uploadedtime: Last upload of the content, garbage collection spares blobs uploaded recently
+"""
+
+class Media(BaseModel):
+    hash = CharField(max_length=64, unique=True)
+    size = IntegerField()
+    content_type = CharField()
+    createdtime = DateTimeField(default=datetime.now)
+    uploadedtime = DateTimeField(default=datetime.now, index=True)
@@ -0,0 +1,21 @@
+from peewee import CharField, DateTimeField, IntegerField
+from db.database import BaseModel
+from datetime import datetime
+
+"""
+About the fields:
+version: Migration version, one row per migration started on this database
+status: running = claimed by a runner, applied = finished
+step: Index of the step the running migration is at, the steps before it are done
+cursor: Last primary key processed by that step's backfill, a restarted runner resumes after it
+updatedtime: Heartbeat of the running migration, a stale one can be taken over
+"""
+
+class MigrationHistory(BaseModel):
+    version = IntegerField(unique=True)
+    name = CharField()
+    status = CharField(default="running")
+    step = IntegerField(default=0)
+    cursor = IntegerField(default=0)
+    updatedtime = DateTimeField(default=datetime.now)
+    appliedtime = DateTimeField(null=True)
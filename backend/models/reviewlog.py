@@ -0,0 +1,24 @@
+from peewee import BigIntegerField, CharField, IntegerField
+from db.database import BaseModel
+
+"""
+Review history, one row per review, the training data of the FSRS optimizer.
+card_id, deck_id: Reviewed card and its deck at review time. Plain ids, not foreign keys: history
+    outlives deleted cards, and imported Anki reviews reference Anki's card ids
+rating: 1 = Again, 2 = Hard, 3 = Good, 4 = Easy
+reviewtime: UTC epoch milliseconds, as in Anki's revlog
+duration: Milliseconds spent on the review, if known
+source: api = captured from the review API, anki = imported revlog
+"""
+
+class ReviewLog(BaseModel):
+    card_id = IntegerField()
+    deck_id = IntegerField(null=True, index=True)
+    rating = IntegerField()
+    reviewtime = BigIntegerField()
+    duration = IntegerField(null=True)
+    source = CharField(default="api")
+
+    class Meta:
+        # Replaying the same review (sync upload, revlog import) is a no-op
+        indexes = ((("source", "card_id", "reviewtime"), True),)
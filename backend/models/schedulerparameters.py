@@ -0,0 +1,21 @@
+from peewee import DateTimeField, FloatField, IntegerField, TextField
+from db.database import BaseModel
+from datetime import datetime
+
+"""
+FSRS parameters fitted by the optimizer, used by the scheduler instead of the defaults.
+deck_id: Deck the parameters were fitted on, NULL for the fit on every review
+parameters: JSON list of the 21 FSRS weights
+reviews: Reviews the parameters were fitted on
+log_loss, rmse: Prediction error on the held-out cards of a fit trained without them, *_default of the FSRS defaults
+"""
+
+class SchedulerParameters(BaseModel):
+    deck_id = IntegerField(null=True, unique=True)
+    parameters = TextField()
+    reviews = IntegerField()
+    log_loss = FloatField()
+    log_loss_default = FloatField()
+    rmse = FloatField()
+    rmse_default = FloatField()
+    updatedtime = DateTimeField(default=datetime.now)
@@ -0,0 +1,10 @@
+from peewee import IntegerField
+from db.database import BaseModel
+
+"""
+Single row holding the last issued update sequence number (usn).
+Every write bumps it and stamps the written row, sync tokens are usn values.
+"""
+
+class SyncSequence(BaseModel):
+    usn = IntegerField(default=0)
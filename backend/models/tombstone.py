@@ -0,0 +1,16 @@
+from peewee import CharField, DateTimeField, IntegerField
+from db.database import BaseModel
+from datetime import datetime
+
+"""
+Tombstones record hard deletes so offline clients can drop the rows on next sync.
+entity: Table name of the deleted row (deck, card, cardreview)
+entity_id: Primary key of the deleted row
+usn: Update sequence number at which the row was deleted
+"""
+
+class Tombstone(BaseModel):
+    entity = CharField()
+    entity_id = IntegerField()
+    usn = IntegerField(index=True)
+    createdtime = DateTimeField(default=datetime.now)
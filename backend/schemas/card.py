@@ -1,8 +1,24 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Literal, Optional
 
 class Card(BaseModel):
     id: Optional[int] = None
     deck_id: Optional[int] = None
     question: Optional[str] = None
-    answer: Optional[str] = None
\ No newline at end of file
+    answer: Optional[str] = None
+
+class CardSelection(BaseModel):
+    card_ids: Optional[List[int]] = None
+    deck_id: Optional[int] = None
+    search: Optional[str] = None
+    state: Optional[Literal["new", "learning", "review", "relearning", "due"]] = None
+    is_trash: Optional[bool] = None
+
+class CardMove(CardSelection):
+    target_deck_id: int
+
+class DuplicateCheck(BaseModel):
+    question: str
+    answer: str
+    deck_id: Optional[int] = None
+    card_id: Optional[int] = None
@@ -0,0 +1,12 @@
+from datetime import datetime
+from pydantic import BaseModel
+from typing import List
+from schemas.cardreviewdue import Rating
+
+class ReviewUpload(BaseModel):
+    card_id: int
+    rating: Rating
+    review_datetime: datetime
+
+class SyncReviews(BaseModel):
+    reviews: List[ReviewUpload]
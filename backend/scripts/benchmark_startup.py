@@ -0,0 +1,52 @@
+"""Measures cold start: import time of the app and of the script entry points
+
+Usage: python3 scripts/benchmark_startup.py [runs]
+Each target is imported in a fresh interpreter `runs` times (default 5), the median wall time
+is reported with its slowest direct imports in the last run (python -X importtime).
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+TARGETS = {
+    "app (main)": "import main",
+    "scripts (db.schema)": "import db.schema",
+    "services": "import services.flashcard",
+    "settings": "from core.config import Config; Config.settings",
+}
+
+def import_times(stderr: str, depth: int = 1) -> list:
+    """(cumulative microseconds, module) from -X importtime output, for modules imported at
+    `depth` (1 = direct imports of the benchmarked module), slowest first"""
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        if (len(module) - len(module.lstrip()) - 1) // 2 == depth:
+            times.append((int(cumulative), module.strip()))
+    return sorted(times, reverse=True)
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+for name, code in TARGETS.items():
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=BACKEND, capture_output=True, text=True,
+        )
+        durations.append(time.perf_counter() - start)
+        if result.returncode:
+            print(result.stderr)
+            sys.exit(result.returncode)
+
+    print(f"{name:<22} {statistics.median(durations) * 1000:8.1f} ms")
+    for cumulative, module in import_times(result.stderr)[:5]:
+        print(f"    {module:<30} {cumulative / 1000:8.1f} ms")
@@ -1,38 +1,50 @@
+"""Applies or reverts versioned migrations on every shard
+
+Usage: python3 scripts/dbmigration.py [--plan] [--target VERSION] [--down VERSION]
+                                      [--chunk-size ROWS] [--throttle SECONDS] [tenant ...]
+    --plan        Show pending migrations with rows left to backfill, change nothing
+    --target      Apply migrations up to this version only
+    --down        Revert applied migrations above this version
+    --chunk-size  Rows updated per backfill transaction (default 1000)
+    --throttle    Seconds to sleep between backfill chunks (default 0.05)
+Without tenants every shard in db/ is processed. Safe to run while the API is serving:
+backfills commit per chunk, and an interrupted run resumes where it stopped.
+"""
+
+import argparse
 import sys, os
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from db.database import *
-from playhouse.migrate import *
-from datetime import datetime
-from models.cardreview import CardReview
-
-connect()
-
-def safe_add_column(table, column, field):
-    cols = [c.name for c in db.get_columns(table)]
-    if column not in cols:
-        migrate(migrator.add_column(table, column, field))
-        print(f"'{column}' column successfully added to {table}")
-
-
-migrator = SqliteMigrator(db)
-
-if not CardReview.table_exists():
-    db.create_tables([CardReview])
-    print("CardReview table created")
-
-# Deck Fields
-safe_add_column('deck', 'is_trash', BooleanField(default=False)),
-    
-# Card Fields
-safe_add_column('card', 'createdtime', DateTimeField(default=datetime.now)),
-safe_add_column('card', 'modifiedtime', DateTimeField(null=True))
-safe_add_column('card', 'is_trash', BooleanField(default=False))
-
-# review
-safe_add_column("cardreview", 'step', IntegerField(null=True))
-
-# TODO, move to ambelic?? something
-
-disconnect()
\ No newline at end of file
+from db.database import pool, use_tenant
+from db.migrations import MigrationRunner
+from db.schema import MIGRATIONS, create_schema
+
+parser = argparse.ArgumentParser(usage=__doc__)
+parser.add_argument("tenants", nargs="*")
+parser.add_argument("--plan", action="store_true")
+parser.add_argument("--target", type=int)
+parser.add_argument("--down", type=int)
+parser.add_argument("--chunk-size", type=int, default=1000)
+parser.add_argument("--throttle", type=float, default=0.05)
+args = parser.parse_args()
+
+# Opening a shard must not start the migrations on its own, this script runs them
+pool.migrate_on_open = False
+runner = MigrationRunner(MIGRATIONS, chunk_size=args.chunk_size, throttle=args.throttle)
+
+for tenant in args.tenants or pool.tenants():
+    print(f"== {tenant}")
+    with use_tenant(tenant):
+        if args.plan:
+            for migration in runner.plan(args.target):
+                print(f"{migration['version']} {migration['name']}")
+                for step in migration["steps"]:
+                    print(f"  {step}")
+        elif args.down is not None:
+            runner.downgrade(args.down)
+        else:
+            create_schema()
+            runner.upgrade(args.target)
+
+pool.close_all()
@@ -0,0 +1,62 @@
+"""Fits FSRS scheduler parameters to the review history of every shard
+
+Usage: python3 scripts/optimize.py [--import-anki CSV [--deck ID]] [--global-only]
+                                   [--min-reviews N] [--workers N] [--dry-run] [tenant ...]
+    --import-anki  Add an Anki revlog CSV export to the review history first
+                   (sqlite3 -header -csv collection.anki2 "SELECT * FROM revlog" > revlog.csv)
+    --deck         Deck the imported reviews belong to, otherwise they count in the global fit only
+    --global-only  Fit every review together, skip the per-deck fits
+    --min-reviews  Reviews a day or more apart needed for a fit (default 1000)
+    --workers      Worker processes for the fits (default: CPU count)
+    --dry-run      Report the fits, store nothing
+Without tenants every shard in db/ is processed. Same job as POST /flashcards/optimizer.
+"""
+
+import argparse
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from db.database import pool, use_tenant
+from services.optimizer import Optimizer, MIN_REVIEWS
+
+def main():
+    parser = argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument("tenants", nargs="*")
+    parser.add_argument("--import-anki")
+    parser.add_argument("--deck", type=int)
+    parser.add_argument("--global-only", action="store_true")
+    parser.add_argument("--min-reviews", type=int, default=MIN_REVIEWS)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    for tenant in args.tenants or pool.tenants():
+        print(f"== {tenant}")
+        with use_tenant(tenant):
+            if args.import_anki:
+                counts = Optimizer.import_anki_revlog(args.import_anki, args.deck)
+                print(f"anki revlog: {counts['read']} read, {counts['imported']} imported, {counts['skipped']} skipped")
+
+            report = Optimizer.run(
+                per_deck=not args.global_only, min_reviews=args.min_reviews,
+                workers=args.workers, save=not args.dry_run,
+            )
+            if not report:
+                print(f"nothing to fit, fewer than {args.min_reviews} reviews")
+            for fit in report:
+                scope = "global" if fit["deck_id"] is None else f"deck {fit['deck_id']}"
+                change = 100 * (fit["log_loss"] - fit["log_loss_default"]) / (fit["log_loss_default"] or 1)
+                print(
+                    f"{scope:<12} {fit['cards']:>8} cards {fit['reviews']:>9} reviews  "
+                    f"held-out log-loss {fit['log_loss_default']:.4f} -> {fit['log_loss']:.4f} ({change:+.1f}%)  "
+                    f"RMSE {fit['rmse_default']:.4f} -> {fit['rmse']:.4f}  "
+                    f"{fit['seconds']}s {'saved' if fit['saved'] else 'not saved'}"
+                )
+
+    pool.close_all()
+
+
+# The fit workers import this module when they start, the work must not run on import
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,25 @@
-"""Applies all tables and schema"""
+"""Applies all tables and schema
+
+Usage: python3 scripts/setup.py [tenant ...]
+Without tenants the default shard (db/velocity.db) is set up.
+"""
 
-from datetime import datetime
 import sys
 import os
 
 # Ensure parent directory is in sys.path so 'models' can be imported
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from db.database import *  # Ensure you import your db instance
-from models.deck import Deck
-from models.card import Card
-from models.cardreview import CardReview
+from db.database import pool, use_tenant, DEFAULT_TENANT
+from db.schema import setup_schema, migrate_schema
+
+# Migrations run here to the end, not in the pool's background thread
+pool.migrate_on_open = False
 
 print("Creating tables")
-with db:
-    db.create_tables([Deck, Card, CardReview])
-print("Created tables")
\ No newline at end of file
+for tenant in sys.argv[1:] or [DEFAULT_TENANT]:
+    with use_tenant(tenant):
+        setup_schema()
+        migrate_schema()
+    print(f"Created tables for {tenant}")
+pool.close_all()
@@ -0,0 +1,54 @@
+"""Runs maintenance across all tenant shards
+
+Usage: python3 scripts/shards.py <command> [tenant ...]
+Commands:
+    list           Shard files with their size
+    check          PRAGMA integrity_check
+    optimize       PRAGMA optimize, refreshes query planner statistics
+    checkpoint     Fold the WAL back into the database file
+    vacuum         Rebuild the file to reclaim free pages
+    buckets        Rebuild near-duplicate buckets of every card (NEAR_DUPLICATES on)
+    media-extract  Move base64 media inlined in cards to the media store
+    media-gc       Delete media no card references, and files of interrupted uploads
+Without tenants every shard in db/ is processed. Migrations: scripts/dbmigration.py
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db.database import db, pool, use_tenant
+from services.duplicates import Duplicates
+from services.media import MediaStore
+
+def shard_size(tenant):
+    path = pool.path(tenant)
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+COMMANDS = {
+    "check": lambda: print(db.execute_sql("PRAGMA integrity_check").fetchone()[0]),
+    "optimize": lambda: db.execute_sql("PRAGMA optimize"),
+    "checkpoint": lambda: db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)"),
+    "vacuum": lambda: db.execute_sql("VACUUM"),
+    "buckets": lambda: print(f"{Duplicates.reindex()} cards indexed"),
+    "media-extract": lambda: print(f"{MediaStore.extract_cards()} cards changed"),
+    "media-gc": lambda: print("{blobs} blobs and {strays} stray files deleted, {bytes} bytes freed".format(**MediaStore.collect_garbage())),
+}
+
+if len(sys.argv) < 2 or sys.argv[1] not in list(COMMANDS) + ["list"]:
+    print(__doc__)
+    sys.exit(1)
+
+command = sys.argv[1]
+tenants = sys.argv[2:] or pool.tenants()
+
+for tenant in tenants:
+    if command == "list":
+        print(f"{tenant}\t{shard_size(tenant)} bytes")
+        continue
+    print(f"{command}: {tenant}")
+    with use_tenant(tenant):
+        COMMANDS[command]()
+
+pool.close_all()
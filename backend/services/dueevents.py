@@ -0,0 +1,290 @@
+"""
+Live due counts
+
+Per tenant with connected clients, a DueNotifier keeps the due card count of every deck in memory.
+It is loaded once with one aggregate query, then kept current without polling the database:
+
+- Cards becoming due within HORIZON are filed in a timer wheel, which counts them in when their due time passes.
+- Reviews, trashes and deletes publish events that move the counts directly, bulk operations ask for a recount.
+
+Changes are collected per tick and pushed to subscribers (SSE connections). A subscriber only keeps
+the latest count per changed deck, so a slow client never queues up more than one update per deck.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from peewee import fn
+from core.logs import logger
+from db.database import use_tenant, get_tenant
+from models.card import Card
+from models.cardreview import CardReview
+from utils import helpers
+from utils.timerwheel import TimerWheel
+
+TICK = 1.0
+# Timers are loaded for cards due within this many seconds, refilled halfway through
+HORIZON = 6 * 3600
+
+
+def to_iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class Subscriber:
+    """One connected client: the deck counts when it connected, then those changed since it last read."""
+
+    def __init__(self, notifier: "DueNotifier", counts: dict):
+        self.notifier = notifier
+        self.counts = counts
+        self.pending = {}
+        self.event = asyncio.Event()
+
+    def push(self, changes: dict) -> None:
+        self.pending.update(changes)
+        self.event.set()
+
+    async def next(self, timeout: float) -> Optional[dict]:
+        """
+        Wait for changes
+        Returns:
+            Optional[dict]: deck_id to due count, None on timeout
+        """
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.event.clear()
+        changes, self.pending = self.pending, {}
+        return changes
+
+
+class DueNotifier:
+    """Due counts of one tenant, updated by timers and events. Only touched from the event loop."""
+
+    def __init__(self, tenant: str):
+        self.tenant = tenant
+        self.counts = {}
+        self.timers = {}
+        self.wheel = TimerWheel(start=time.time(), tick=TICK)
+        self.loaded_until = 0.0
+        self.changed = set()
+        self.subscribers = set()
+        self.loading = False
+        # First load, every subscriber waits for it
+        self.ready: Optional[asyncio.Future] = None
+        self.waiting = 0
+
+    def query_counts(self) -> dict:
+        """deck_id to number of due, non-trashed cards. Runs in a worker thread."""
+        with use_tenant(self.tenant):
+            query = (
+                CardReview
+                .select(Card.deck.alias("deck_id"), fn.COUNT(CardReview.id).alias("count"))
+                .join(Card, on=(Card.id == CardReview.card))
+                .where(CardReview.due <= helpers.now_iso(), ~Card.is_trash)
+                .group_by(Card.deck)
+            )
+            return {row["deck_id"]: row["count"] for row in query.dicts()}
+
+    def query_upcoming(self, start: float, until: float) -> list:
+        """(card_id, deck_id, due timestamp) of cards becoming due in (start, until]. Runs in a worker thread."""
+        with use_tenant(self.tenant):
+            query = (
+                CardReview
+                .select(CardReview.card, Card.deck, CardReview.due)
+                .join(Card, on=(Card.id == CardReview.card))
+                .where(CardReview.due > to_iso(start), CardReview.due <= to_iso(until), ~Card.is_trash)
+                .tuples()
+            )
+            return [(card_id, deck_id, helpers.to_timestamp(due)) for card_id, deck_id, due in query]
+
+    async def load(self) -> None:
+        """Recount everything and reload the timers"""
+        self.loading = True
+        try:
+            now = time.time()
+            counts = await run_in_threadpool(self.query_counts)
+            upcoming = await run_in_threadpool(self.query_upcoming, now, now + HORIZON)
+        finally:
+            self.loading = False
+
+        self.changed.update(set(self.counts) | set(counts))
+        self.counts = counts
+        self.timers = {}
+        self.wheel = TimerWheel(start=now, tick=TICK)
+        self.loaded_until = now + HORIZON
+        self.add_timers(upcoming)
+
+    async def extend(self) -> None:
+        """Load the timers of the next part of the horizon"""
+        self.loading = True
+        try:
+            start, until = self.loaded_until, time.time() + HORIZON
+            upcoming = await run_in_threadpool(self.query_upcoming, start, until)
+        finally:
+            self.loading = False
+        self.loaded_until = until
+        self.add_timers(upcoming)
+
+    def add_timers(self, upcoming: list) -> None:
+        for card_id, deck_id, due in upcoming:
+            self.timers[card_id] = (due, deck_id)
+            self.wheel.add(due, (card_id, due))
+
+    def adjust(self, deck_id: int, delta: int) -> None:
+        self.counts[deck_id] = max(0, self.counts.get(deck_id, 0) + delta)
+        self.changed.add(deck_id)
+
+    def card_changed(self, card_id: int, deck_id: int, old_due: Optional[float], new_due: Optional[float]) -> None:
+        """
+        A card's due time changed. None means the card isn't (or no longer) in the due queue,
+        e.g. never reviewed, trashed or deleted.
+        """
+        now = time.time()
+        if card_id in self.timers:
+            # Not counted yet, its timer simply must not fire
+            del self.timers[card_id]
+        elif old_due is not None and old_due <= now:
+            self.adjust(deck_id, -1)
+
+        if new_due is None:
+            return
+        if new_due <= now:
+            self.adjust(deck_id, 1)
+        elif new_due <= self.loaded_until:
+            self.add_timers([(card_id, deck_id, new_due)])
+
+    def advance(self, now: float) -> None:
+        for card_id, due in self.wheel.advance(now):
+            # A rescheduled or removed card leaves its old entry in the wheel, only its current timer counts
+            timer = self.timers.get(card_id)
+            if timer and timer[0] == due:
+                del self.timers[card_id]
+                self.adjust(timer[1], 1)
+
+    def flush(self) -> None:
+        if not self.changed:
+            return
+        changes = {deck_id: self.counts.get(deck_id, 0) for deck_id in self.changed}
+        self.changed = set()
+        for subscriber in self.subscribers:
+            subscriber.push(changes)
+
+
+class DueEvents:
+    """Notifiers of the tenants with connected clients, and the task ticking them."""
+
+    def __init__(self):
+        self.notifiers = {}
+        self.loop = None
+        self.task = None
+
+    async def subscribe(self, tenant: str) -> Subscriber:
+        """
+        Subscribe to the tenant's due counts, once they are loaded.
+        Raises:
+            Exception: What the first load of the counts raised, the next subscriber retries it
+        """
+        self.loop = asyncio.get_running_loop()
+        notifier = self.notifiers.get(tenant)
+        if not notifier:
+            notifier = DueNotifier(tenant)
+            self.notifiers[tenant] = notifier
+            notifier.ready = asyncio.ensure_future(self.first_load(notifier))
+
+        notifier.waiting += 1
+        try:
+            # Shielded, a client disconnecting doesn't cancel the load the others wait for
+            await asyncio.shield(notifier.ready)
+        except asyncio.CancelledError:
+            notifier.waiting -= 1
+            self.release(notifier)
+            raise
+        notifier.waiting -= 1
+
+        # No await from here on: the snapshot and the changes pushed after it can't miss an update
+        subscriber = Subscriber(notifier, dict(notifier.counts))
+        notifier.subscribers.add(subscriber)
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        return subscriber
+
+    async def first_load(self, notifier: DueNotifier) -> None:
+        try:
+            await notifier.load()
+        except BaseException:
+            self.remove(notifier)
+            raise
+        # Subscribers start from the loaded counts, not from changes
+        notifier.changed = set()
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscriber.notifier.subscribers.discard(subscriber)
+        self.release(subscriber.notifier)
+
+    def release(self, notifier: DueNotifier) -> None:
+        """Drop the notifier once no client is subscribed or waiting for its first load"""
+        if not notifier.subscribers and not notifier.waiting:
+            self.remove(notifier)
+
+    def remove(self, notifier: DueNotifier) -> None:
+        if self.notifiers.get(notifier.tenant) is notifier:
+            del self.notifiers[notifier.tenant]
+
+    async def run(self) -> None:
+        while self.notifiers:
+            await asyncio.sleep(TICK)
+            now = time.time()
+            for notifier in list(self.notifiers.values()):
+                try:
+                    notifier.advance(now)
+                    if not notifier.loading and notifier.loaded_until - now < HORIZON / 2:
+                        asyncio.create_task(notifier.extend())
+                    notifier.flush()
+                except Exception as e:
+                    logger.error(e)
+
+    def active(self) -> Optional[DueNotifier]:
+        """Notifier of the current tenant, None when no client is listening"""
+        return self.notifiers.get(get_tenant())
+
+    def dispatch(self, notifier: DueNotifier, method: str, *args) -> None:
+        # Events come from request handlers, possibly on worker threads
+        self.loop.call_soon_threadsafe(lambda: getattr(notifier, method)(*args))
+
+    def review_changed(self, card_id: int, old_due, new_due) -> None:
+        """A card was reviewed, its due moved from old_due (None if new) to new_due"""
+        notifier = self.active()
+        if not notifier:
+            return
+        card = Card.get_or_none(Card.id == card_id)
+        if card and not card.is_trash:
+            self.dispatch(notifier, "card_changed", card_id, card.deck_id,
+                          helpers.to_timestamp(old_due), helpers.to_timestamp(new_due))
+
+    def card_removed(self, card_id: int) -> None:
+        """A card is being trashed or deleted, call before deleting it"""
+        notifier = self.active()
+        if not notifier:
+            return
+        review = (
+            CardReview.select(CardReview.due, Card.deck)
+            .join(Card, on=(Card.id == CardReview.card))
+            .where(CardReview.card == card_id, ~Card.is_trash)
+            .dicts()
+            .first()
+        )
+        if review:
+            self.dispatch(notifier, "card_changed", card_id, review["deck"], helpers.to_timestamp(review["due"]), None)
+
+    def refresh(self) -> None:
+        """Many cards changed at once, recount"""
+        notifier = self.active()
+        if notifier:
+            self.loop.call_soon_threadsafe(lambda: asyncio.create_task(notifier.load()))
+
+
+due_events = DueEvents()
@@ -0,0 +1,197 @@
+"""
+Duplicate cards
+
+Exact duplicates share a fingerprint: sha1 of question and answer after normalization
+(markup stripped but the sources of images and other media kept, case folded, whitespace
+collapsed), stored on the card and indexed.
+
+Near duplicates, when NEAR_DUPLICATES config is on, use MinHash over character shingles split
+into LSH bands. Each band is stored as a CardBucket row, cards sharing a bucket are candidates
+and are confirmed by their shingle Jaccard similarity (DUPLICATE_SIMILARITY, default 0.7).
+"""
+
+import hashlib
+import html
+import random
+import re
+from typing import Optional
+from peewee import fn
+from playhouse.shortcuts import model_to_dict
+from core.config import Config
+from db.database import db
+from models.card import Card
+from models.cardbucket import CardBucket
+
+PAGE_LIMIT = 10
+SHINGLE_SIZE = 5
+BANDS = 8
+ROWS = 4
+PRIME = (1 << 61) - 1
+
+_random = random.Random(20240501)
+PERMUTATIONS = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME)) for _ in range(BANDS * ROWS)]
+
+BLOCK_TAG_PATTERN = re.compile(r"<\s*/?\s*(br|p|div|li|tr|td|h[1-6])\b[^>]*>", re.IGNORECASE)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+# Tags with a source (img, audio, video, source), the source tells image-only cards apart
+SOURCE_TAG_PATTERN = re.compile(r"""<[^>]*?\bsrc\s*=\s*["']?([^"'\s>]+)[^>]*>""", re.IGNORECASE)
+MARKUP_PATTERN = re.compile(r"[*_`~#>|]+")
+
+
+class Duplicates:
+    """Service class for exact and near duplicate card detection."""
+
+    @staticmethod
+    def normalize(text: Optional[str]) -> str:
+        """Strip HTML and markdown markup, keeping media sources, fold case and collapse whitespace"""
+        text = SOURCE_TAG_PATTERN.sub(r" \1 ", text or "")
+        # Block tags separate words, inline ones (<b>, <i>, <span>) don't
+        text = TAG_PATTERN.sub("", BLOCK_TAG_PATTERN.sub(" ", text))
+        text = html.unescape(text)
+        text = MARKUP_PATTERN.sub(" ", text)
+        return " ".join(text.casefold().split())
+
+    @staticmethod
+    def fingerprint(question: Optional[str], answer: Optional[str]) -> str:
+        content = Duplicates.normalize(question) + "\x1f" + Duplicates.normalize(answer)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def shingles(question: Optional[str], answer: Optional[str]) -> set:
+        text = Duplicates.normalize(question) + " " + Duplicates.normalize(answer)
+        if len(text) <= SHINGLE_SIZE:
+            return {text}
+        return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+    @staticmethod
+    def buckets(question: Optional[str], answer: Optional[str]) -> list:
+        """MinHash signature of the card split into LSH band buckets"""
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+            for shingle in Duplicates.shingles(question, answer)
+        ]
+        signature = [min((a * h + b) % PRIME for h in hashes) for a, b in PERMUTATIONS]
+        buckets = []
+        for band in range(BANDS):
+            rows = ",".join(map(str, signature[band * ROWS:(band + 1) * ROWS]))
+            buckets.append(f"{band}:{hashlib.blake2b(rows.encode(), digest_size=8).hexdigest()}")
+        return buckets
+
+    @staticmethod
+    def similarity(a: set, b: set) -> float:
+        return len(a & b) / len(a | b) if a or b else 1.0
+
+    @staticmethod
+    def near_enabled() -> bool:
+        return Config.settings.near_duplicates
+
+    @staticmethod
+    def index_card(card_id: int, question: str, answer: str) -> None:
+        """Replace the card's LSH buckets, no-op unless near duplicate detection is on"""
+        if not Duplicates.near_enabled():
+            return
+        with db.atomic():
+            CardBucket.delete().where(CardBucket.card == card_id).execute()
+            CardBucket.insert_many(
+                [{"card": card_id, "bucket": bucket} for bucket in Duplicates.buckets(question, answer)]
+            ).execute()
+
+    @staticmethod
+    def reindex(chunk_size: int = 1000) -> int:
+        """
+        Rebuild the LSH buckets of every card, one transaction per chunk
+        Returns:
+            int: Number of cards indexed
+        """
+        CardBucket.delete().execute()
+        last_id, count = 0, 0
+        while True:
+            rows = list(
+                Card.select(Card.id, Card.question, Card.answer)
+                .where(Card.id > last_id).order_by(Card.id).limit(chunk_size).tuples()
+            )
+            if not rows:
+                return count
+            with db.atomic():
+                CardBucket.insert_many([
+                    {"card": card_id, "bucket": bucket}
+                    for card_id, question, answer in rows
+                    for bucket in Duplicates.buckets(question, answer)
+                ]).execute()
+            last_id, count = rows[-1][0], count + len(rows)
+
+    @staticmethod
+    def find(question: str, answer: str, deck_id: Optional[int] = None, exclude_id: Optional[int] = None) -> dict:
+        """
+        Find existing cards duplicating a candidate card
+        Args:
+            question (str): Candidate question
+            answer (str): Candidate answer
+            deck_id (Optional[int]): Only look in this deck
+            exclude_id (Optional[int]): Card to leave out, the candidate itself when editing
+        Returns:
+            dict: exact duplicate cards, and near duplicates with their similarity when enabled
+        """
+        query = Card.select().where(Card.fingerprint == Duplicates.fingerprint(question, answer), ~Card.is_trash)
+        if deck_id:
+            query = query.where(Card.deck == deck_id)
+        if exclude_id:
+            query = query.where(Card.id != exclude_id)
+        exact = [model_to_dict(card, recurse=False) for card in query]
+        result = {"exact": exact}
+
+        if Duplicates.near_enabled():
+            exact_ids = {card["id"] for card in exact}
+            candidates = (
+                Card.select()
+                .join(CardBucket, on=(CardBucket.card == Card.id))
+                .where(CardBucket.bucket.in_(Duplicates.buckets(question, answer)), ~Card.is_trash)
+                .distinct()
+            )
+            if deck_id:
+                candidates = candidates.where(Card.deck == deck_id)
+            shingles = Duplicates.shingles(question, answer)
+            threshold = Config.settings.duplicate_similarity
+            near = []
+            for card in candidates:
+                if card.id in exact_ids or card.id == exclude_id:
+                    continue
+                similarity = Duplicates.similarity(shingles, Duplicates.shingles(card.question, card.answer))
+                if similarity >= threshold:
+                    near.append({**model_to_dict(card, recurse=False), "similarity": round(similarity, 3)})
+            result["near"] = sorted(near, key=lambda card: -card["similarity"])
+        return result
+
+    @staticmethod
+    def clusters(filters: dict) -> list:
+        """
+        List groups of exact duplicate cards, biggest first
+        Args:
+            filters (dict): 'deck_id' to look in one deck, 'page' for pagination
+        Returns:
+            list: Clusters with fingerprint, count and card IDs
+        """
+        page = int(filters.get("page", 1))
+        offset = (page - 1) * PAGE_LIMIT
+
+        query = (
+            Card
+            .select(Card.fingerprint, fn.COUNT(Card.id).alias("count"), fn.GROUP_CONCAT(Card.id).alias("card_ids"))
+            .where(Card.fingerprint.is_null(False), ~Card.is_trash)
+            .group_by(Card.fingerprint)
+            .having(fn.COUNT(Card.id) > 1)
+            .order_by(fn.COUNT(Card.id).desc(), Card.fingerprint)
+            .limit(PAGE_LIMIT)
+            .offset(offset)
+        )
+        if filters.get("deck_id"):
+            query = query.where(Card.deck == filters["deck_id"])
+
+        return [
+            {
+                "fingerprint": row["fingerprint"],
+                "count": row["count"],
+                "card_ids": [int(card_id) for card_id in row["card_ids"].split(",")],
+            }
+            for row in query.dicts()
+        ]
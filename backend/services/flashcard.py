@@ -8,9 +8,19 @@ import json
 from playhouse.shortcuts import model_to_dict
 from services.spacedrepetition import SpacedRepetition
 from utils import helpers
-from peewee import fn
+from peewee import fn, Value, JOIN
+from db.database import db
+from services.sync import Sync
+from models.tombstone import Tombstone
+from models.cardbucket import CardBucket
+from models.schedulerparameters import SchedulerParameters
+from models.cardmedia import CardMedia
+from services.duplicates import Duplicates
+from services.media import MediaStore
+from services.dueevents import due_events
 
 PAGE_LIMIT = 10
+REVIEW_STATES = {"learning": 1, "review": 2, "relearning": 3}
 
 class Flashcard:
     """Service class for managing flashcards, decks, and reviews."""
@@ -63,7 +73,9 @@ class Flashcard:
                 deck.author = author
             deck.modifiedtime = datetime.now()
 
-        deck.save()
+        with db.atomic():
+            deck.usn = Sync.next_usn()
+            deck.save()
         return model_to_dict(deck)
 
     @staticmethod
@@ -178,8 +190,17 @@ class Flashcard:
                 card.answer = answer
             card.modifiedtime = datetime.now()
 
+        # Inline base64 media go to the media store, the row keeps only their url
+        card.question = MediaStore.extract_inline(card.question)
+        card.answer = MediaStore.extract_inline(card.answer)
+        card.fingerprint = Duplicates.fingerprint(card.question, card.answer)
+
         # Peewee's save() handles both insert and update
-        card.save()
+        with db.atomic():
+            card.usn = Sync.next_usn()
+            card.save()
+            Duplicates.index_card(card.id, card.question, card.answer)
+            MediaStore.index_card(card.id, card.question, card.answer)
         return model_to_dict(card, recurse=False)
 
     @staticmethod
@@ -241,9 +262,12 @@ class Flashcard:
             if Flashcard.is_deck_in_use(deck_id):
                 raise ValueError(f"Cannot delete deck '{deck_id}' because it contains cards. Please delete or move cards first.")
 
-            num_deleted = Deck.delete().where(Deck.id == deck_id).execute()
-            if num_deleted == 0:
-                raise ValueError(f"Deck Id '{deck_id}' does not exist.")
+            with db.atomic():
+                num_deleted = Deck.delete().where(Deck.id == deck_id).execute()
+                if num_deleted == 0:
+                    raise ValueError(f"Deck Id '{deck_id}' does not exist.")
+                SchedulerParameters.delete().where(SchedulerParameters.deck_id == deck_id).execute()
+                Sync.add_tombstones("deck", [deck_id], Sync.next_usn())
             return True
         except ValueError:
             raise
@@ -277,7 +301,9 @@ class Flashcard:
 
             deck.is_trash = True
             deck.modifiedtime = datetime.now()
-            deck.save()
+            with db.atomic():
+                deck.usn = Sync.next_usn()
+                deck.save()
             return True
         except ValueError:
             raise
@@ -288,7 +314,7 @@ class Flashcard:
     @staticmethod
     def delete_card(card_id: int) -> bool:
         """
-        Delete a card by its ID.
+        Delete a card by its ID, along with its reviews.
 
         Args:
             card_id (int): The ID of the card to delete.
@@ -301,9 +327,18 @@ class Flashcard:
             RuntimeError: If an error occurs during deletion.
         """
         try:
-            num_deleted = Card.delete().where(Card.id == card_id).execute()
-            if num_deleted == 0:
-                raise ValueError(f"Card Id '{card_id}' does not exist.")
+            due_events.card_removed(card_id)
+            with db.atomic():
+                usn = Sync.next_usn()
+                reviews = [review_id for (review_id,) in CardReview.select(CardReview.id).where(CardReview.card == card_id).tuples()]
+                CardReview.delete().where(CardReview.card == card_id).execute()
+                CardBucket.delete().where(CardBucket.card == card_id).execute()
+                CardMedia.delete().where(CardMedia.card == card_id).execute()
+                num_deleted = Card.delete().where(Card.id == card_id).execute()
+                if num_deleted == 0:
+                    raise ValueError(f"Card Id '{card_id}' does not exist.")
+                Sync.add_tombstones("card", [card_id], usn)
+                Sync.add_tombstones("cardreview", reviews, usn)
             return True
         except ValueError:
             raise
@@ -326,15 +361,133 @@ class Flashcard:
             card = Card.get_or_none(Card.id == card_id)
             if not card:
                 raise ValueError(f"Card Id '{card_id}' does not exist.")
+            due_events.card_removed(card_id)
             card.is_trash = True
             card.modifiedtime = datetime.now()
-            card.save()
+            with db.atomic():
+                card.usn = Sync.next_usn()
+                card.save()
             return True
         except ValueError:
             raise
         except Exception as e:
             raise RuntimeError("Failed to trash card") from e
 
+    @staticmethod
+    def select_cards(selection: dict):
+        """
+        Build the query selecting card ids by a list of ids and/or filters, filters are combined with AND
+        Args:
+            selection (dict):
+                - card_ids (list): Card IDs
+                - deck_id (int): Cards of the deck
+                - search (str): Text contained in question or answer
+                - state (str): new, learning, review, relearning or due
+                - is_trash (bool): Only trashed or only non-trashed cards
+        Returns:
+            Query of Card.id, usable as a subquery
+        Raises:
+            ValueError: If the selection is empty or the state is unknown
+        """
+        selection = {k: v for k, v in (selection or {}).items() if v is not None}
+        if not selection:
+            raise ValueError("Select cards by card_ids or at least one filter.")
+
+        query = Card.select(Card.id)
+        if "card_ids" in selection:
+            query = query.where(Card.id.in_(selection["card_ids"]))
+        if "deck_id" in selection:
+            query = query.where(Card.deck == selection["deck_id"])
+        if "search" in selection:
+            search = selection["search"]
+            query = query.where(Card.question.contains(search) | Card.answer.contains(search))
+        if "is_trash" in selection:
+            query = query.where(Card.is_trash == bool(selection["is_trash"]))
+
+        state = selection.get("state")
+        if state == "new":
+            query = query.where(Card.id.not_in(CardReview.select(CardReview.card)))
+        elif state == "due":
+            query = query.where(Card.id.in_(CardReview.select(CardReview.card).where(CardReview.due <= helpers.now_iso())))
+        elif state in REVIEW_STATES:
+            query = query.where(Card.id.in_(CardReview.select(CardReview.card).where(CardReview.state == REVIEW_STATES[state])))
+        elif state is not None:
+            raise ValueError(f"Unknown card state '{state}'.")
+        return query
+
+    @staticmethod
+    def update_cards(selection: dict, **fields) -> int:
+        """
+        Update the selected cards with a single UPDATE, stamping modifiedtime and usn
+        Returns:
+            int: Number of cards updated
+        """
+        cards = Flashcard.select_cards(selection)
+        with db.atomic():
+            fields.update(modifiedtime=datetime.now(), usn=Sync.next_usn())
+            count = Card.update(**fields).where(Card.id.in_(cards)).execute()
+        due_events.refresh()
+        return count
+
+    @staticmethod
+    def move_cards(selection: dict, deck_id: int) -> int:
+        """
+        Move the selected cards to another deck
+        Args:
+            selection (dict): Cards to move, see select_cards
+            deck_id (int): Target deck ID
+        Returns:
+            int: Number of cards moved
+        Raises:
+            ValueError: If the target deck doesn't exist
+        """
+        if not Deck.get_or_none(Deck.id == deck_id):
+            raise ValueError(f"Deck with id '{deck_id}' does not exist.")
+        return Flashcard.update_cards(selection, deck=deck_id)
+
+    @staticmethod
+    def trash_cards(selection: dict) -> int:
+        """Trash the selected cards, returns the number of cards trashed"""
+        return Flashcard.update_cards(selection, is_trash=True)
+
+    @staticmethod
+    def restore_cards(selection: dict) -> int:
+        """Restore the selected cards from trash, returns the number of cards restored"""
+        return Flashcard.update_cards(selection, is_trash=False)
+
+    @staticmethod
+    def delete_cards(selection: dict) -> dict:
+        """
+        Delete the selected cards along with their reviews, in one transaction
+        Args:
+            selection (dict): Cards to delete, see select_cards
+        Returns:
+            dict: Number of cards and reviews deleted
+        """
+        cards = Flashcard.select_cards(selection)
+        now = datetime.now()
+        with db.atomic():
+            usn = Sync.next_usn()
+
+            # Tombstones first: they hold the selected ids for the following statements,
+            # the selection itself may depend on the reviews being deleted
+            Tombstone.insert_from(
+                cards.select(Value("card"), Card.id, Value(usn), Value(now)),
+                [Tombstone.entity, Tombstone.entity_id, Tombstone.usn, Tombstone.createdtime],
+            ).execute()
+            deleted = Tombstone.select(Tombstone.entity_id).where(Tombstone.usn == usn, Tombstone.entity == "card")
+
+            Tombstone.insert_from(
+                CardReview.select(Value("cardreview"), CardReview.id, Value(usn), Value(now)).where(CardReview.card.in_(deleted)),
+                [Tombstone.entity, Tombstone.entity_id, Tombstone.usn, Tombstone.createdtime],
+            ).execute()
+            reviews = CardReview.delete().where(CardReview.card.in_(deleted)).execute()
+            CardBucket.delete().where(CardBucket.card.in_(deleted)).execute()
+            CardMedia.delete().where(CardMedia.card.in_(deleted)).execute()
+            count = Card.delete().where(Card.id.in_(deleted)).execute()
+        due_events.refresh()
+        return {"cards": count, "reviews": reviews}
+
     @staticmethod
     def get_due_cards(filters: Optional[Union[dict, str]] = None):
         """
@@ -359,24 +512,40 @@ class Flashcard:
             deck_id = filters.get("deck_id")
             query = query.join(Card).where(Card.deck == deck_id, ~Card.is_trash)
 
-        due_cards = query.where(CardReview.due <= datetime.now()).limit(PAGE_LIMIT).offset(offset)
-        return [model_to_dict(card, recurse=False) for card in due_cards]
+        due_cards = query.where(CardReview.due <= helpers.now_iso()).limit(PAGE_LIMIT).offset(offset)
+        return list(due_cards.dicts())
 
     @staticmethod
     def get_due_decks(filters: dict) -> list:
+        """
+        Due card count of every non-trashed deck, 0 included: the due page lists each deck so live
+        updates have a row to change when a deck's first card becomes due.
+        Args:
+            filters (dict): page
+        Returns:
+            list: count, deck_id and deck_name per deck, by deck id
+        """
         page = int(filters.get("page", 1))
         offset: int = (page - 1) * PAGE_LIMIT
 
-        query = (
+        due = (
             CardReview
+            .select(Card.deck.alias("deck_id"), fn.COUNT(CardReview.id).alias("count"))
+            .join(Card, on=(Card.id == CardReview.card_id))
+            .where(CardReview.due <= helpers.now_iso(), ~Card.is_trash)
+            .group_by(Card.deck)
+            .alias("due")
+        )
+        query = (
+            Deck
             .select(
-                fn.COUNT(CardReview.id).alias("count"),
+                fn.COALESCE(due.c.count, 0).alias("count"),
                 Deck.id.alias("deck_id"),
                 Deck.name.alias("deck_name")
             )
-            .join(Card, on=(Card.id == CardReview.card_id))
-            .join(Deck, on=(Deck.id == Card.deck))
-            .group_by(Deck.id)
+            .join(due, JOIN.LEFT_OUTER, on=(due.c.deck_id == Deck.id))
+            .where(~Deck.is_trash)
+            .order_by(Deck.id)
             .limit(PAGE_LIMIT)
             .offset(offset)
         )
@@ -409,3 +578,17 @@ class Flashcard:
         result = sr.get_next_due(card_id, user_rating)
 
         return result
+
+    @staticmethod
+    def preview_due_cards(filters: Optional[Union[dict, str]] = None) -> list:
+        """
+        Preview every rating for a page of due cards, nothing is saved
+        Args:
+            filters (Optional[Union[dict, str]]): Filters for pagination and deck filtering, same as get_due_cards
+        Returns:
+            list: Per card, the due date and interval for each rating
+        """
+        sr = SpacedRepetition()
+        rows = Flashcard.get_due_cards(filters)
+        schedulers = sr.schedulers(sr.card_decks(row["card"] for row in rows))
+        return [sr.preview_card(row["card"], row, scheduler=schedulers[row["card"]]) for row in rows]
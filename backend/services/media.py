@@ -0,0 +1,291 @@
+"""
+Media store
+
+Card attachments are stored once per shard on disk, named by the sha256 of their content:
+MEDIA_DIR/<tenant>/<hash[:2]>/<hash>. Cards reference them by url (/flashcards/media/<tenant>/<hash>,
+the tenant is in the url as browsers load media without the tenant header) in their question or
+answer, the references are indexed in CardMedia. The bytes never go through the database: uploads
+stream to a temporary file hashed on the way (in the threadpool), downloads are served from the file.
+
+Base64 data uris in card text are moved to the store when the card is saved, and by
+`scripts/shards.py media-extract` for existing cards. Blobs no card references are deleted by
+`scripts/shards.py media-gc`.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+from peewee import fn
+from starlette.concurrency import run_in_threadpool
+from core.config import Config
+from db.database import db, get_tenant
+from models.card import Card
+from models.media import Media
+from models.cardmedia import CardMedia
+from services.sync import Sync
+
+URL_PREFIX = "/flashcards/media/"
+HASH_PATTERN = r"^[0-9a-f]{64}$"
+# Urls written before the tenant was part of them have none, they still count as references
+MEDIA_URL = re.compile(re.escape(URL_PREFIX) + r"(?:[A-Za-z0-9_-]{1,64}/)?([0-9a-f]{64})")
+DATA_URI = re.compile(r"data:((?:image|audio|video)/[\w.+-]+);base64,([A-Za-z0-9+/]+=*)")
+CONTENT_TYPES = ("image/", "audio/", "video/")
+GC_GRACE = timedelta(hours=24)  # an upload has this long to get referenced by a card
+UPLOAD_PREFIX = ".upload-"
+
+class MediaTooLarge(ValueError):
+    """Upload larger than MEDIA_MAX_SIZE"""
+
+class BlobWriter:
+    """Temporary file in the tenant's media directory, hashed while it is written"""
+
+    def __init__(self, max_size: Optional[int] = None):
+        os.makedirs(MediaStore.tenant_dir(), exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=MediaStore.tenant_dir(), prefix=UPLOAD_PREFIX, delete=False)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.max_size = max_size
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise MediaTooLarge(f"Media is larger than {self.max_size} bytes.")
+        self.digest.update(chunk)
+        self.file.write(chunk)
+
+    def commit(self, content_type: str) -> dict:
+        """
+        Move the file to its content address, or drop it when the content is already stored.
+        The row is written first: a blob with a fresh uploadedtime is never garbage collected.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        digest = self.digest.hexdigest()
+        now = datetime.now()
+        (
+            Media.insert(hash=digest, size=self.size, content_type=content_type, createdtime=now, uploadedtime=now)
+            .on_conflict(conflict_target=[Media.hash], update={Media.uploadedtime: now})
+            .execute()
+        )
+        path = MediaStore.path(digest)
+        if os.path.exists(path):
+            os.unlink(self.file.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.file.name, path)
+        return MediaStore.describe(Media.get(Media.hash == digest))
+
+    def discard(self) -> None:
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.unlink(self.file.name)
+
+
+class MediaStore:
+
+    @staticmethod
+    def tenant_dir(tenant: Optional[str] = None) -> str:
+        """Media directory of the tenant, of the current context's by default"""
+        return os.path.join(Config.settings.media_dir, tenant or get_tenant())
+
+    @staticmethod
+    def path(digest: str) -> str:
+        """File of a blob of the current tenant"""
+        return os.path.join(MediaStore.tenant_dir(), digest[:2], digest)
+
+    @staticmethod
+    def url(digest: str) -> str:
+        """Url of a blob of the current tenant"""
+        return f"{URL_PREFIX}{get_tenant()}/{digest}"
+
+    @staticmethod
+    def allowed(content_type: str) -> bool:
+        """Only images, audio and video are stored, nothing a browser would run as a page"""
+        return content_type.startswith(CONTENT_TYPES)
+
+    @staticmethod
+    def describe(media: Media) -> dict:
+        return {
+            "hash": media.hash,
+            "size": media.size,
+            "content_type": media.content_type,
+            "url": MediaStore.url(media.hash),
+        }
+
+    @staticmethod
+    def get(digest: str) -> Optional[Media]:
+        return Media.get_or_none(Media.hash == digest)
+
+    @staticmethod
+    async def store_stream(chunks: AsyncIterator[bytes], content_type: str) -> dict:
+        """
+        Store an upload as it arrives, without holding it in memory. File writes, fsync and the
+        row are done in the threadpool, only reading the body runs on the event loop.
+        Args:
+            chunks (AsyncIterator[bytes]): Body of the upload, e.g. Request.stream().
+            content_type (str): Media type of the content.
+        Returns:
+            dict: hash, size, content_type and url of the stored blob.
+        Raises:
+            MediaTooLarge: If the upload exceeds MEDIA_MAX_SIZE, nothing is stored.
+        """
+        writer = await run_in_threadpool(BlobWriter, Config.settings.media_max_size)
+        try:
+            async for chunk in chunks:
+                await run_in_threadpool(writer.write, chunk)
+            return await run_in_threadpool(writer.commit, content_type)
+        except BaseException:
+            await run_in_threadpool(writer.discard)
+            raise
+
+    @staticmethod
+    def store(data: bytes, content_type: str) -> dict:
+        """Store content already in memory, see store_stream"""
+        writer = BlobWriter()
+        try:
+            writer.write(data)
+            return writer.commit(content_type)
+        except BaseException:
+            writer.discard()
+            raise
+
+    @staticmethod
+    def extract_inline(text: Optional[str]) -> Optional[str]:
+        """
+        Move base64 data uris (images, audio, video) of card text to the store.
+        Returns:
+            Optional[str]: The text with each data uri replaced by its media url.
+        """
+        if not text or ";base64," not in text:
+            return text
+
+        def replace(match: re.Match) -> str:
+            try:
+                data = base64.b64decode(match.group(2), validate=True)
+            except binascii.Error:
+                return match.group(0)
+            return MediaStore.store(data, match.group(1))["url"]
+
+        return DATA_URI.sub(replace, text)
+
+    @staticmethod
+    def references(*texts: Optional[str]) -> set:
+        """Hashes of the media urls in the texts"""
+        return {digest for text in texts if text for digest in MEDIA_URL.findall(text)}
+
+    @staticmethod
+    def index_card(card_id: int, question: str, answer: str) -> None:
+        """Replace the card's media references"""
+        with db.atomic():
+            CardMedia.delete().where(CardMedia.card == card_id).execute()
+            digests = MediaStore.references(question, answer)
+            if digests:
+                CardMedia.insert_many([{"card": card_id, "hash": digest} for digest in digests]).execute()
+
+    @staticmethod
+    def extract_cards(chunk_size: int = 200) -> int:
+        """
+        Move inline base64 media of every card to the store, one transaction per chunk.
+        Changed cards get a new usn so clients sync the smaller text.
+        Returns:
+            int: Number of cards changed
+        """
+        last_id, count = 0, 0
+        inline = Card.question.contains(";base64,") | Card.answer.contains(";base64,")
+        while True:
+            cards = list(Card.select().where(Card.id > last_id, inline).order_by(Card.id).limit(chunk_size))
+            if not cards:
+                return count
+            with db.atomic():
+                usn = Sync.next_usn()
+                for card in cards:
+                    question, answer = MediaStore.extract_inline(card.question), MediaStore.extract_inline(card.answer)
+                    if (question, answer) == (card.question, card.answer):
+                        continue
+                    Card.update(question=question, answer=answer, usn=usn).where(Card.id == card.id).execute()
+                    MediaStore.index_card(card.id, question, answer)
+                    count += 1
+            last_id = cards[-1].id
+
+    @staticmethod
+    def collect_garbage(chunk_size: int = 500, grace: timedelta = GC_GRACE) -> dict:
+        """
+        Delete blobs no card references (trashed cards still do) and not uploaded within grace,
+        then files left without a row (interrupted uploads). One transaction per chunk.
+        A row is deleted before its file, and the file is moved aside before the row is checked
+        again: a concurrent upload of the same content writes the row before it looks for the file,
+        so either it finds no file and stores its own, or the check finds its row and the file is
+        put back.
+        Returns:
+            dict: Number of blobs and stray files deleted, and bytes freed
+        """
+        cutoff = datetime.now() - grace
+        unreferenced = ~fn.EXISTS(CardMedia.select().where(CardMedia.hash == Media.hash))
+        blobs, strays, freed, last_id = 0, 0, 0, 0
+
+        while True:
+            rows = list(
+                Media.select(Media.id, Media.hash, Media.size)
+                .where(Media.id > last_id, Media.uploadedtime < cutoff, unreferenced)
+                .order_by(Media.id).limit(chunk_size).tuples()
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            with db.atomic():
+                Media.delete().where(
+                    Media.id.in_([row[0] for row in rows]), Media.uploadedtime < cutoff, unreferenced
+                ).execute()
+            for _, digest, size in rows:
+                path = MediaStore.path(digest)
+                # A leftover of a crash here is an interrupted upload to stale_files, deleted by the next run
+                aside = os.path.join(MediaStore.tenant_dir(), UPLOAD_PREFIX + digest)
+                try:
+                    os.replace(path, aside)
+                except FileNotFoundError:
+                    continue
+                if MediaStore.get(digest):
+                    os.replace(aside, path)
+                else:
+                    os.unlink(aside)
+                    blobs += 1
+                    freed += size
+
+        for files in MediaStore.stale_files(cutoff.timestamp(), chunk_size):
+            known = {digest for (digest,) in Media.select(Media.hash).where(Media.hash.in_(list(files))).tuples()}
+            for name, path in files.items():
+                if name not in known:
+                    freed += os.path.getsize(path)
+                    os.unlink(path)
+                    strays += 1
+
+        return {"blobs": blobs, "strays": strays, "bytes": freed}
+
+    @staticmethod
+    def stale_files(before: float, chunk_size: int):
+        """
+        Blob files and temporary uploads of the tenant's media directory last modified before
+        the timestamp, in chunks of {name: path}. Other files are left alone.
+        """
+        root = MediaStore.tenant_dir()
+        if not os.path.isdir(root):
+            return
+        files = {}
+        for directory, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                blob = re.match(HASH_PATTERN, name) and directory == os.path.dirname(MediaStore.path(name))
+                upload = name.startswith(UPLOAD_PREFIX) and directory == root
+                if (blob or upload) and os.path.getmtime(path) < before:
+                    files[name] = path
+                if len(files) == chunk_size:
+                    yield files
+                    files = {}
+        if files:
+            yield files
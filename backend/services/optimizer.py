@@ -0,0 +1,248 @@
+"""
+FSRS parameter optimizer
+
+Fits the scheduler's FSRS weights to the review history (ReviewLog): once on every review and
+once per deck with enough reviews of its own. The fits run in a process pool, workers only get
+NumPy arrays and never touch the database, see utils/fsrsfit for the model and the loss.
+
+Each fit is trained without a held-out share of the cards. When it predicts those better than the
+FSRS defaults (lower log-loss), it is refitted on every card and stored in SchedulerParameters,
+SpacedRepetition.schedulers() uses it from the next review on.
+
+Pool workers are started by a forkserver, not forked from the threaded app, and one job runs at
+a time per process (MAX_JOBS).
+"""
+
+import csv
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Optional
+from peewee import fn
+from playhouse.shortcuts import model_to_dict
+from core.logs import logger
+from db.database import db, use_tenant
+from models.reviewlog import ReviewLog
+from models.schedulerparameters import SchedulerParameters
+
+MIN_REVIEWS = 1000      # predicted reviews (a day or more apart) needed to fit a deck, or the global parameters
+IMPORT_BATCH = 50_000
+ANKI_REVIEW_TYPES = {"0", "1", "2", "3"}  # learn, review, relearn, filtered; not manual reschedules
+MAX_JOBS = 1            # optimizer jobs running at once in this process, each uses every CPU
+
+class Optimizer:
+
+    # Tenants with a job in progress in this process, one job per tenant at a time
+    running = set()
+    # Taken by the endpoint for each job, released when the job ends
+    slots = threading.BoundedSemaphore(MAX_JOBS)
+
+    @staticmethod
+    def import_anki_revlog(path: str, deck_id: Optional[int] = None) -> dict:
+        """
+        Import an Anki revlog CSV export into the review history, importing it again is a no-op.
+        Export: sqlite3 -header -csv collection.anki2 "SELECT * FROM revlog" > revlog.csv
+        Ratings are taken as the 4 button scheduler's (Anki 2.1 v2/v3), rows without a rating and
+        manual reschedules are skipped.
+
+        Args:
+            path (str): CSV with Anki's revlog columns: id (review time, epoch ms), cid, ease, time, type.
+            deck_id (Optional[int]): Deck to fit the reviews with, None to use them in the global fit only.
+        Returns:
+            dict: Counts of rows read, imported and skipped (invalid or already imported).
+        Raises:
+            ValueError: If a required column is missing.
+        """
+        read, rows = 0, []
+        before = ReviewLog.select().where(ReviewLog.source == "anki").count()
+
+        with open(path, newline="") as file:
+            reader = csv.DictReader(file)
+            missing = {"id", "cid", "ease", "type"} - set(reader.fieldnames or [])
+            if missing:
+                raise ValueError(f"Revlog CSV is missing columns: {', '.join(sorted(missing))}")
+
+            for record in reader:
+                read += 1
+                if record["type"] not in ANKI_REVIEW_TYPES or record["ease"] not in {"1", "2", "3", "4"}:
+                    continue
+                rows.append((
+                    int(record["cid"]), deck_id, int(record["ease"]), int(record["id"]),
+                    int(record["time"]) if record.get("time") else None, "anki",
+                ))
+                if len(rows) == IMPORT_BATCH:
+                    Optimizer.insert_reviews(rows)
+                    rows = []
+            Optimizer.insert_reviews(rows)
+
+        imported = ReviewLog.select().where(ReviewLog.source == "anki").count() - before
+        return {"read": read, "imported": imported, "skipped": read - imported}
+
+    @staticmethod
+    def insert_reviews(rows: list) -> None:
+        """
+        Insert review history rows in one transaction, reviews already recorded are ignored.
+        A prepared statement run with executemany, building the equivalent insert_many query
+        costs more than the insert itself on large imports.
+        Args:
+            rows (list): (card_id, deck_id, rating, reviewtime, duration, source) tuples.
+        """
+        sql = (
+            f'INSERT OR IGNORE INTO "{ReviewLog._meta.table_name}" '
+            '("card_id", "deck_id", "rating", "reviewtime", "duration", "source") VALUES (?, ?, ?, ?, ?, ?)'
+        )
+        with db.atomic():
+            db.cursor().executemany(sql, rows)
+
+    @staticmethod
+    def load_history() -> dict:
+        """
+        The whole review history as NumPy arrays, sorted by card then review time.
+        Returns:
+            dict: card_index (0..cards-1), card_id, deck_id (-1 when unknown), reviewtime and rating per review.
+        """
+        import numpy as np
+
+        query = (
+            ReviewLog
+            .select(
+                ReviewLog.source == "anki",
+                ReviewLog.card_id,
+                fn.COALESCE(ReviewLog.deck_id, -1),
+                ReviewLog.reviewtime,
+                ReviewLog.rating,
+            )
+            .order_by(ReviewLog.source, ReviewLog.card_id, ReviewLog.reviewtime)
+            .tuples()
+        )
+        dtype = [("anki", "i1"), ("card_id", "i8"), ("deck_id", "i8"), ("reviewtime", "i8"), ("rating", "i1")]
+        rows = np.fromiter(query.iterator(), dtype=dtype)
+
+        changed = (rows["anki"][1:] != rows["anki"][:-1]) | (rows["card_id"][1:] != rows["card_id"][:-1])
+        return {
+            "card_index": np.r_[0, np.cumsum(changed)] if len(rows) else np.zeros(0, np.int64),
+            "card_id": rows["card_id"],
+            "deck_id": rows["deck_id"],
+            "reviewtime": rows["reviewtime"],
+            "rating": rows["rating"],
+        }
+
+    @staticmethod
+    def run(per_deck: bool = True, min_reviews: int = MIN_REVIEWS, workers: Optional[int] = None,
+            save: bool = True) -> list:
+        """
+        Fit FSRS parameters on the current tenant's review history, in a process pool.
+        Args:
+            per_deck (bool): Fit each deck with at least min_reviews too, not only every review together.
+            min_reviews (int): Predicted reviews needed for a fit.
+            workers (Optional[int]): Worker processes, defaults to the CPU count.
+            save (bool): Store fits that beat the defaults, False for a dry run.
+        Returns:
+            list: Per fit, deck_id (None = every review), cards, reviews, log-loss and RMSE of the
+                defaults and the fit on the held-out cards, seconds taken and whether it was saved.
+        """
+        import numpy as np
+        from utils import fsrsfit
+
+        history = Optimizer.load_history()
+        held_out = fsrsfit.holdout(history["card_id"])
+
+        def pack(selected: np.ndarray) -> dict:
+            return fsrsfit.pack(history["card_index"][selected], history["reviewtime"][selected], history["rating"][selected])
+
+        scopes = {None: np.ones(len(held_out), bool)}
+        if per_deck and len(history["card_index"]):
+            # A card belongs to the deck of its latest review, moved cards keep their whole history
+            last = np.r_[history["card_index"][1:] != history["card_index"][:-1], True]
+            card_deck = history["deck_id"][last]
+            review_deck = card_deck[history["card_index"]]
+            for deck_id in np.unique(card_deck[card_deck >= 0]):
+                scopes[int(deck_id)] = review_deck == deck_id
+
+        fits = {}
+        for deck_id, selected in scopes.items():
+            full = pack(selected)
+            if full["reviews"] < min_reviews:
+                logger.info(f"Optimizer: {full['reviews']} reviews for deck {deck_id}, {min_reviews} needed")
+                continue
+            fits[deck_id] = {"train": pack(selected & ~held_out), "test": pack(selected & held_out), "full": full}
+        if not fits:
+            return []
+
+        # Largest fits first so the long ones don't end up last on a busy pool
+        order = sorted(fits, key=lambda deck_id: fits[deck_id]["full"]["reviews"], reverse=True)
+        # Workers are forked from a clean server process rather than this threaded one, it preloads
+        # the fit code so they start with NumPy imported. Like with spawn, they import __main__.
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["utils.fsrsfit"])
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(order)), mp_context=context) as executor:
+            futures = {deck_id: executor.submit(fsrsfit.validate, **fits[deck_id]) for deck_id in order}
+            results = {deck_id: future.result() for deck_id, future in futures.items()}
+
+        report = []
+        for deck_id in order:
+            result = results[deck_id]
+            improved = result["parameters"] is not None
+            if save:
+                Optimizer.save_parameters(deck_id, result if improved else None)
+            report.append({"deck_id": deck_id, **result, "saved": save and improved})
+        return report
+
+    @staticmethod
+    def run_job(tenant: str, **options) -> None:
+        """
+        Background task of the optimizer endpoint: run() on the tenant's shard. The caller adds
+        the tenant to Optimizer.running and takes one of Optimizer.slots, both are released when
+        the job ends.
+        """
+        try:
+            with use_tenant(tenant):
+                for fit in Optimizer.run(**options):
+                    logger.info(f"Optimizer {tenant}: {fit}")
+        except Exception as e:
+            logger.error(f"Optimizer {tenant} failed: {e}")
+        finally:
+            Optimizer.running.discard(tenant)
+            Optimizer.slots.release()
+
+    @staticmethod
+    def save_parameters(deck_id: Optional[int], result: Optional[dict]) -> None:
+        """
+        Replace the stored parameters of a deck (None = every review) with a fit.
+        Args:
+            deck_id (Optional[int]): Deck the fit is for, None for the global fit.
+            result (Optional[dict]): Output of utils.fsrsfit.validate, None to drop the stored parameters,
+                the deck then falls back to the global fit or the defaults.
+        """
+        scope = SchedulerParameters.deck_id.is_null() if deck_id is None else SchedulerParameters.deck_id == deck_id
+        with db.atomic():
+            SchedulerParameters.delete().where(scope).execute()
+            if result:
+                SchedulerParameters.create(
+                    deck_id=deck_id,
+                    parameters=json.dumps(result["parameters"]),
+                    reviews=result["reviews"],
+                    log_loss=result["log_loss"],
+                    log_loss_default=result["log_loss_default"],
+                    rmse=result["rmse"],
+                    rmse_default=result["rmse_default"],
+                    updatedtime=datetime.now(),
+                )
+
+    @staticmethod
+    def get_parameters() -> list:
+        """
+        Stored parameters with their evaluation, the global fit first.
+        Returns:
+            list: SchedulerParameters rows as dicts, parameters decoded.
+        """
+        query = SchedulerParameters.select().order_by(SchedulerParameters.deck_id.asc(nulls="first"))
+        results = []
+        for row in query:
+            result = model_to_dict(row)
+            result["parameters"] = json.loads(row.parameters)
+            results.append(result)
+        return results
@@ -5,14 +5,42 @@ Uses Py-FSRS service
 Ref: https://github.com/open-spaced-repetition/py-fsrs
 """
 
-from fsrs import Scheduler, Card, Rating
+from datetime import datetime, timezone
+from functools import lru_cache
+import json
+from typing import Optional, TYPE_CHECKING
+from peewee import chunked
 from playhouse.shortcuts import model_to_dict
 from core.logs import logger
+from db.database import db
+from models.card import Card as CardModel
 from models.cardreview import CardReview
+from models.reviewlog import ReviewLog
+from models.schedulerparameters import SchedulerParameters
+from services.sync import Sync
+from services.dueevents import due_events
+from utils import helpers
+
+# fsrs is imported on first use, importing the services (scripts, workers) doesn't load it
+if TYPE_CHECKING:
+    from fsrs import Scheduler, Card, Rating
+
+@lru_cache(maxsize=64)
+def get_scheduler(parameters: Optional[tuple] = None) -> "Scheduler":
+    """
+    Scheduler shared by all reviews and previews using the same parameters, it keeps no per-card state.
+    parameters are fitted FSRS weights (scripts/optimize.py), None for the FSRS defaults.
+    """
+    from fsrs import Scheduler
+
+    # TODO, test result with and without fuzzing
+    if parameters is None:
+        return Scheduler(enable_fuzzing=False)
+    return Scheduler(parameters=parameters, enable_fuzzing=False)
 
 class SpacedRepetition:
 
-    def get_next_due(self, card_id: int, user_rating: Rating) -> dict:
+    def get_next_due(self, card_id: int, user_rating: "Rating", review_datetime: Optional[datetime] = None) -> dict:
         """
         Calculate the next due date for a card based on review rating.
 
@@ -20,42 +48,218 @@ class SpacedRepetition:
             card_info (dict): The card information as a dictionary, containing fields required by FSRS.
             rating (int or Rating, optional): The review rating (can be int or Rating enum). 
                 If not provided, FSRS may determine due based on current data/state.
+            review_datetime (datetime, optional): UTC time the review happened, defaults to now.
 
         Returns:
             dict: The card state after scheduling, including updated due date and FSRS state fields.
         """
 
-        # TODO, test result with and without fuzzing
-        scheduler = Scheduler(enable_fuzzing=False)
+        decks = self.card_decks([card_id])
+        scheduler = self.schedulers(decks)[card_id]
         cardreview = CardReview.get_or_none(CardReview.card == card_id)
-
-        # for new card use card_id only
-        if cardreview:
-            # cardreview['difficulty'] = difficulty
-
-            cardinfo = model_to_dict(cardreview, recurse=False)
-            cardinfo["card_id"] = card_id
-            del cardinfo["id"]
-            logger.info("Previous Card Review")
-            logger.info(cardinfo) 
-            card = Card.from_dict(cardinfo)
-        else:
-            logger.info("Packing new card review")
-            card = Card(card_id=card_id)
+        card = self.to_fsrs_card(card_id, cardreview)
 
         logger.info(f"New User rating {user_rating}")
         
-        reviewed_card, _ = scheduler.review_card(card, user_rating.value)
+        reviewed_card, _ = scheduler.review_card(card, user_rating.value, review_datetime)
         logger.info("Next Due")
         logger.info(reviewed_card.to_json())
 
-        self.save_cardreview(card_id, reviewed_card.to_dict())
+        with db.atomic():
+            self.save_cardreview(card_id, reviewed_card.to_dict())
+            self.log_reviews([(card_id, decks.get(card_id), user_rating.value, reviewed_card.last_review)])
 
         # To check retrievability
         # retrieve = scheduler.get_card_retrievability(reviewed_card)
 
         return reviewed_card.to_dict()
 
+    def apply_reviews(self, reviews: list) -> dict:
+        """
+        Apply reviews recorded offline, in one transaction.
+        Reviews are replayed per card in time order. A review not newer than the card's
+        last_review is skipped, so uploading the same batch again is a no-op, and so is a
+        review of a card deleted on the server meanwhile.
+        Args:
+            reviews (list): Dicts with 'card_id', 'rating' (Rating) and 'review_datetime' (UTC datetime).
+        Returns:
+            dict: Counts of applied and skipped reviews and the usn after the upload.
+        """
+        reviews = sorted(reviews, key=lambda r: (r["card_id"], r["review_datetime"]))
+        card_ids = {r["card_id"] for r in reviews}
+        decks = self.card_decks(card_ids)
+        schedulers = self.schedulers(decks)
+        applied, skipped, logs = 0, 0, []
+
+        with db.atomic():
+            cardreviews = {
+                cr.card_id: cr for cr in CardReview.select().where(CardReview.card.in_(card_ids))
+            } if card_ids else {}
+            cards = {}
+            for review in reviews:
+                card_id = review["card_id"]
+                if decks[card_id] is None:
+                    skipped += 1
+                    continue
+                card = cards.get(card_id) or self.to_fsrs_card(card_id, cardreviews.get(card_id))
+                if card.last_review and card.last_review >= review["review_datetime"]:
+                    skipped += 1
+                    continue
+                cards[card_id], _ = schedulers[card_id].review_card(card, review["rating"].value, review["review_datetime"])
+                logs.append((card_id, decks.get(card_id), review["rating"].value, review["review_datetime"]))
+                applied += 1
+
+            for card_id, card in cards.items():
+                self.save_cardreview(card_id, card.to_dict())
+            self.log_reviews(logs)
+            usn = Sync.current_usn()
+
+        return {"applied": applied, "skipped": skipped, "usn": usn}
+
+    def preview(self, card_ids: list, now: Optional[datetime] = None) -> list:
+        """
+        Preview the outcome of every rating for the given cards, nothing is saved.
+        Args:
+            card_ids (list): Card IDs to preview, cards never reviewed are previewed as new.
+            now (Optional[datetime]): UTC time of the review, defaults to now.
+        Returns:
+            list: Per card, the due date and interval for each rating.
+        """
+        card_ids = list(dict.fromkeys(card_ids))
+        if not card_ids:
+            return []
+
+        query = (
+            CardReview
+            .select(
+                CardReview.card, CardReview.state, CardReview.step, CardReview.stability,
+                CardReview.difficulty, CardReview.due, CardReview.last_review,
+            )
+            .where(CardReview.card.in_(card_ids))
+        )
+        rows = {row["card"]: row for row in query.dicts()}
+        schedulers = self.schedulers(self.card_decks(card_ids))
+        return [self.preview_card(card_id, rows.get(card_id), now, schedulers[card_id]) for card_id in card_ids]
+
+    def preview_card(self, card_id: int, row: Optional[dict], now: Optional[datetime] = None,
+                     scheduler: Optional["Scheduler"] = None) -> dict:
+        """
+        Schedule one card with each rating without saving.
+        Args:
+            card_id (int): The card's ID.
+            row (Optional[dict]): Stored CardReview fields of the card, None for a new card.
+            now (Optional[datetime]): UTC time of the review, defaults to now.
+            scheduler (Optional[Scheduler]): Scheduler of the card's deck, from schedulers(), defaults to the FSRS defaults.
+        Returns:
+            dict: card_id and, per rating name, the next due and interval in seconds.
+        """
+        from fsrs import Card, Rating
+
+        scheduler = scheduler or get_scheduler()
+        now = now or datetime.now(timezone.utc)
+        card = self.card_from_row(card_id, row) if row else Card(card_id=card_id)
+
+        ratings = {}
+        for rating in (Rating.Again, Rating.Hard, Rating.Good, Rating.Easy):
+            reviewed_card, _ = scheduler.review_card(card, rating, now)
+            interval = int((reviewed_card.due - now).total_seconds())
+            ratings[rating.name] = {
+                "due": reviewed_card.due.isoformat(),
+                "interval": interval,
+                "label": helpers.format_interval(interval),
+            }
+        return {"card_id": card_id, "ratings": ratings}
+
+    def card_decks(self, card_ids) -> dict:
+        """
+        Deck of each card.
+        Args:
+            card_ids (Iterable[int]): Card IDs.
+        Returns:
+            dict: card_id -> deck_id, None for a card that doesn't exist.
+        """
+        decks = dict.fromkeys(card_ids)
+        if decks:
+            query = CardModel.select(CardModel.id, CardModel.deck).where(CardModel.id.in_(list(decks)))
+            decks.update(query.tuples())
+        return decks
+
+    def schedulers(self, decks: dict) -> dict:
+        """
+        Scheduler of each card: the parameters fitted on its deck, else the ones fitted on
+        every review, else the FSRS defaults.
+        Args:
+            decks (dict): card_id -> deck_id, from card_decks().
+        Returns:
+            dict: card_id -> Scheduler, for every card in decks.
+        """
+        query = SchedulerParameters.select(SchedulerParameters.deck_id, SchedulerParameters.parameters).where(
+            SchedulerParameters.deck_id.in_(set(decks.values())) | SchedulerParameters.deck_id.is_null()
+        )
+        fitted = {deck_id: tuple(json.loads(parameters)) for deck_id, parameters in query.tuples()}
+        default = fitted.get(None)
+        return {card_id: get_scheduler(fitted.get(deck_id, default)) for card_id, deck_id in decks.items()}
+
+    def log_reviews(self, reviews: list) -> None:
+        """
+        Record reviews in the review history, the optimizer's training data. Already recorded ones are ignored.
+        Args:
+            reviews (list): (card_id, deck_id, rating, review_datetime) tuples, review_datetime UTC aware.
+        """
+        rows = [
+            {
+                "card_id": card_id,
+                "deck_id": deck_id,
+                "rating": rating,
+                "reviewtime": int(review_datetime.timestamp() * 1000),
+            }
+            for card_id, deck_id, rating, review_datetime in reviews
+        ]
+        for batch in chunked(rows, 500):
+            ReviewLog.insert_many(batch).on_conflict_ignore().execute()
+
+    def card_from_row(self, card_id: int, row: dict) -> "Card":
+        """
+        Build the FSRS card from stored CardReview fields.
+        Args:
+            card_id (int): The card's ID.
+            row (dict): CardReview fields, as returned by model_to_dict or a .dicts() query.
+        Returns:
+            Card: FSRS card ready to be scheduled.
+        """
+        from fsrs import Card
+
+        return Card.from_dict({
+            "card_id": card_id,
+            "state": row["state"],
+            "step": row["step"],
+            "stability": row["stability"],
+            "difficulty": row["difficulty"],
+            "due": helpers.to_isoformat(row["due"]),
+            "last_review": helpers.to_isoformat(row["last_review"]),
+        })
+
+    def to_fsrs_card(self, card_id: int, cardreview: Optional[CardReview]) -> "Card":
+        """
+        Build the FSRS card for a stored CardReview, or a fresh one for a new card.
+        Args:
+            card_id (int): The card's ID.
+            cardreview (Optional[CardReview]): Stored review state of the card, if any.
+        Returns:
+            Card: FSRS card ready to be scheduled.
+        """
+        # for new card use card_id only
+        if not cardreview:
+            from fsrs import Card
+
+            logger.info("Packing new card review")
+            return Card(card_id=card_id)
+
+        cardinfo = model_to_dict(cardreview, recurse=False)
+        logger.info("Previous Card Review")
+        logger.info(cardinfo)
+        return self.card_from_row(card_id, cardinfo)
+
     def save_cardreview(self, card_id: int, result: dict) -> None:
         """
         Create a new CardReview if it doesn't exist, or update the existing one.
@@ -63,27 +267,33 @@ class SpacedRepetition:
             card_id (int): The card's ID.
             result (dict): State dictionary to update or create with.
         """
-        cardreview = CardReview.get_or_none(CardReview.card == card_id)
-        if cardreview:
-            logger.info("Updating Card Review")
-            logger.info(result)
-            cardreview.state = result.get("state")
-            cardreview.step = result.get("step")
-            cardreview.stability = result.get("stability")
-            cardreview.difficulty = result.get("difficulty")
-            cardreview.due = result.get("due")
-            cardreview.last_review = result.get("last_review")
-            logger.info(model_to_dict(cardreview, recurse=False))
-            cardreview.save()
-        else:
-            logger.info("Creating Card Review")
-            logger.info(result)
-            CardReview.create(
-                card=card_id,
-                state=result.get("state"),
-                step=result.get("step", 1),
-                stability=result.get("stability"),
-                difficulty=result.get("difficulty"),
-                due=result.get("due"),
-                last_review=result.get("last_review"),
-            )
\ No newline at end of file
+        with db.atomic():
+            usn = Sync.next_usn()
+            cardreview = CardReview.get_or_none(CardReview.card == card_id)
+            old_due = cardreview.due if cardreview else None
+            if cardreview:
+                logger.info("Updating Card Review")
+                logger.info(result)
+                cardreview.state = result.get("state")
+                cardreview.step = result.get("step")
+                cardreview.stability = result.get("stability")
+                cardreview.difficulty = result.get("difficulty")
+                cardreview.due = result.get("due")
+                cardreview.last_review = result.get("last_review")
+                cardreview.usn = usn
+                logger.info(model_to_dict(cardreview, recurse=False))
+                cardreview.save()
+            else:
+                logger.info("Creating Card Review")
+                logger.info(result)
+                CardReview.create(
+                    card=card_id,
+                    state=result.get("state"),
+                    step=result.get("step", 1),
+                    stability=result.get("stability"),
+                    difficulty=result.get("difficulty"),
+                    due=result.get("due"),
+                    last_review=result.get("last_review"),
+                    usn=usn,
+                )
+        due_events.review_changed(card_id, old_due, result.get("due"))
@@ -0,0 +1,94 @@
+"""
+Delta sync
+
+Every write to a deck, card or card review is stamped with an update sequence number (usn)
+taken from a single counter. Clients keep the usn of their last sync as a token and ask only
+for rows stamped after it, hard deletes are kept as tombstones.
+"""
+
+from typing import Optional
+from playhouse.shortcuts import model_to_dict
+from db.database import db
+from models.card import Card
+from models.deck import Deck
+from models.cardreview import CardReview
+from models.syncsequence import SyncSequence
+from models.tombstone import Tombstone
+
+class Sync:
+    """Service class for change tracking and delta sync of offline clients."""
+
+    @staticmethod
+    def next_usn() -> int:
+        """
+        Issue the next update sequence number.
+        Call inside the transaction of the write it stamps: the counter UPDATE takes the
+        SQLite write lock first, so usn order matches commit order.
+        Returns:
+            int: The new usn
+        """
+        with db.atomic():
+            updated = SyncSequence.update(usn=SyncSequence.usn + 1).where(SyncSequence.id == 1).execute()
+            if not updated:
+                SyncSequence.create(id=1, usn=1)
+            return SyncSequence.get_by_id(1).usn
+
+    @staticmethod
+    def current_usn() -> int:
+        """
+        Get the last issued update sequence number.
+        Returns:
+            int: The current usn, 0 if nothing was written yet
+        """
+        sequence = SyncSequence.get_or_none(SyncSequence.id == 1)
+        return sequence.usn if sequence else 0
+
+    @staticmethod
+    def add_tombstones(entity: str, entity_ids: list, usn: int) -> None:
+        """
+        Record hard deleted rows so clients can remove them.
+        Args:
+            entity (str): Table name of the deleted rows (deck, card, cardreview)
+            entity_ids (list): IDs of the deleted rows
+            usn (int): usn of the delete
+        """
+        rows = [{"entity": entity, "entity_id": entity_id, "usn": usn} for entity_id in entity_ids]
+        if rows:
+            Tombstone.insert_many(rows).execute()
+
+    @staticmethod
+    def get_changes(token: Optional[int] = None) -> dict:
+        """
+        Get everything changed after the given sync token.
+        Args:
+            token (Optional[int]): usn of the client's last sync, None or 0 for a full sync
+        Returns:
+            dict: New token, changed decks, cards, reviews and deleted IDs per entity
+        """
+        token = token or 0
+
+        # One read transaction, so the token and the rows come from the same snapshot
+        with db.atomic():
+            usn = Sync.current_usn()
+            decks = Deck.select().where(Deck.usn > token).order_by(Deck.usn)
+            cards = Card.select().where(Card.usn > token).order_by(Card.usn)
+            reviews = CardReview.select().where(CardReview.usn > token).order_by(CardReview.usn)
+            if not token:
+                # Full sync, rows written before change tracking have usn 0
+                decks = Deck.select()
+                cards = Card.select()
+                reviews = CardReview.select()
+
+            deleted = {"deck": [], "card": [], "cardreview": []}
+            if token:
+                tombstones = Tombstone.select().where(Tombstone.usn > token).order_by(Tombstone.usn)
+                for tombstone in tombstones:
+                    deleted.setdefault(tombstone.entity, []).append(tombstone.entity_id)
+
+            return {
+                "token": usn,
+                "decks": [model_to_dict(deck) for deck in decks],
+                "cards": [model_to_dict(card, recurse=False) for card in cards],
+                "reviews": [model_to_dict(review, recurse=False) for review in reviews],
+                "deleted": deleted,
+            }
@@ -0,0 +1,5 @@
+import sys
+import os
+
+# Ensure the backend directory is in sys.path so 'services', 'utils' etc. can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,63 @@
+import time
+from services.dueevents import DueNotifier, HORIZON
+from utils.timerwheel import TimerWheel
+
+
+def test_wheel_fires_in_deadline_order():
+    wheel = TimerWheel(start=0, tick=1, slots=4, levels=2)
+    for deadline, item in [(30, "overflow"), (2, "a"), (9, "b"), (5, "c")]:
+        wheel.add(deadline, item)
+
+    assert wheel.advance(1) == []
+    assert wheel.advance(6) == ["a", "c"]
+    assert wheel.advance(20) == ["b"]
+    assert wheel.advance(31) == ["overflow"]
+
+
+def test_wheel_fires_past_deadlines_on_next_advance():
+    wheel = TimerWheel(start=100, tick=1)
+    wheel.add(50, "late")
+    assert wheel.advance(100) == ["late"]
+
+
+def notifier(now: float) -> DueNotifier:
+    notifier = DueNotifier("test")
+    notifier.wheel = TimerWheel(start=now, tick=1)
+    notifier.loaded_until = now + HORIZON
+    return notifier
+
+
+def test_timer_counts_card_when_due():
+    now = time.time()
+    due = notifier(now)
+    due.card_changed(1, 7, None, now + 100)
+
+    due.advance(now + 50)
+    assert due.counts == {}
+    due.advance(now + 101)
+    assert due.counts == {7: 1}
+
+
+def test_rescheduled_card_ignores_its_old_timer():
+    now = time.time()
+    due = notifier(now)
+    due.card_changed(1, 7, None, now + 100)
+    # Reviewed early, due much later
+    due.card_changed(1, 7, now + 100, now + 2000)
+
+    due.advance(now + 150)
+    assert due.counts.get(7, 0) == 0
+    assert 1 in due.timers
+    due.advance(now + 2001)
+    assert due.counts == {7: 1}
+
+
+def test_removed_card_ignores_its_timer():
+    now = time.time()
+    due = notifier(now)
+    due.card_changed(1, 7, None, now + 100)
+    due.card_changed(1, 7, now + 100, None)
+
+    due.advance(now + 150)
+    assert due.counts.get(7, 0) == 0
+    assert due.timers == {}
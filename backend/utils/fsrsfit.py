@@ -0,0 +1,282 @@
+"""
+FSRS parameter fitting with NumPy
+
+Replays review histories under many parameter sets at once: the memory state (stability,
+difficulty) of every card is one array row per parameter set, so a single pass over the reviews
+evaluates the loss at a point and at all of its finite-difference neighbours, the gradient costs
+one batched replay instead of 43 loops. The memory model is the one of py-fsrs' Scheduler (FSRS-6),
+it doesn't depend on the card's learning state so histories replay without it.
+
+A fit is judged on cards it wasn't trained on: validate() holds out a share of the cards, scores
+the fit on them and only then refits on every card.
+
+Imports nothing from the app, validate() runs in optimizer worker processes.
+Ref: https://github.com/open-spaced-repetition/py-fsrs/blob/main/fsrs/optimizer.py
+"""
+
+import math
+import time
+import numpy as np
+from fsrs.scheduler import (
+    DEFAULT_PARAMETERS, LOWER_BOUNDS_PARAMETERS, UPPER_BOUNDS_PARAMETERS,
+    STABILITY_MIN, MIN_DIFFICULTY, MAX_DIFFICULTY,
+)
+
+DAY_MS = 86_400_000
+MAX_SEQ_LEN = 64        # only the first 64 reviews of a card are replayed, as py-fsrs does
+EPOCHS = 5
+BATCH_REVIEWS = 512     # reviews per gradient step, raised so an epoch takes at most MAX_STEPS
+MAX_STEPS = 200
+LEARNING_RATE = 4e-2
+EVAL_CARDS = 65_536     # cards per chunk when evaluating a whole history
+EPSILON = 1e-7
+HOLDOUT = 0.2           # share of cards kept out of training to score a fit
+
+LOWER = np.array(LOWER_BOUNDS_PARAMETERS)
+UPPER = np.array(UPPER_BOUNDS_PARAMETERS)
+
+
+def pack(card_index: np.ndarray, reviewtime: np.ndarray, rating: np.ndarray) -> dict:
+    """
+    Pad review histories into per-card rows, longest history first.
+    Args:
+        card_index (np.ndarray): Card of each review, reviews sorted by card then time.
+        reviewtime (np.ndarray): Review time, UTC epoch milliseconds.
+        rating (np.ndarray): Rating 1-4 of each review.
+    Returns:
+        dict: ratings and elapsed days (cards x reviews, 0 padded), active (cards with a review at
+            each position) and reviews (count of reviews that are predicted, at least a day apart).
+    """
+    if not len(card_index):
+        return {"ratings": np.zeros((0, 0), np.int8), "elapsed": np.zeros((0, 0)),
+                "active": np.zeros(0, np.int64), "reviews": 0}
+
+    starts = np.flatnonzero(np.r_[True, card_index[1:] != card_index[:-1]])
+    lengths = np.minimum(np.diff(np.r_[starts, len(card_index)]), MAX_SEQ_LEN)
+    order = np.argsort(-lengths, kind="stable")
+    starts, lengths = starts[order], lengths[order]
+
+    width = int(lengths[0])
+    positions = np.arange(width)
+    mask = positions < lengths[:, None]
+    source = (starts[:, None] + positions)[mask]
+
+    ratings = np.zeros((len(starts), width), np.int8)
+    ratings[mask] = rating[source]
+    times = np.zeros((len(starts), width), np.int64)
+    times[mask] = reviewtime[source]
+
+    # Whole days since the previous review, like timedelta.days in Scheduler.review_card
+    elapsed = np.zeros((len(starts), width))
+    elapsed[:, 1:] = np.where(mask[:, 1:], (times[:, 1:] - times[:, :-1]) // DAY_MS, 0)
+
+    active = mask.sum(axis=0)
+    return {
+        "ratings": ratings,
+        "elapsed": elapsed,
+        "active": active,
+        "reviews": int((elapsed[:, 1:][mask[:, 1:]] >= 1).sum()),
+    }
+
+
+def holdout(card_id: np.ndarray, share: float = HOLDOUT) -> np.ndarray:
+    """
+    Whether each review belongs to a held-out card. Cards are picked by a hash of their id: all
+    reviews of a card land on the same side, and the split is the same on every run.
+    """
+    hashed = card_id.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return (hashed >> np.uint64(40)) < np.uint64(share * 2 ** 24)
+
+
+def replay(parameters: np.ndarray, ratings: np.ndarray, elapsed: np.ndarray, active: np.ndarray) -> tuple:
+    """
+    Replay histories under each parameter set and score the predicted retrievability.
+    Args:
+        parameters (np.ndarray): Parameter sets, shape (sets, 21).
+        ratings, elapsed, active: A slice of pack()'s rows, longest history first.
+    Returns:
+        tuple: Summed log-loss and squared error per parameter set, and the number of predicted reviews.
+    """
+    w = parameters.T[:, :, None]                    # w[i] has shape (sets, 1)
+    sets, cards = len(parameters), len(ratings)
+    log_loss, squared_error, count = np.zeros(sets), np.zeros(sets), 0
+    if not cards:
+        return log_loss, squared_error, count
+
+    decay = -w[20]
+    factor = 0.9 ** (1 / decay) - 1
+    easy_difficulty = w[4] - np.exp(w[5] * 3) + 1   # initial difficulty of Easy, mean reversion target
+    short_term_forget = np.exp(w[17] * w[18])
+
+    first = ratings[:, 0].astype(np.int64)
+    stability = np.maximum(parameters[:, first - 1], STABILITY_MIN)
+    difficulty = np.clip(w[4] - np.exp(w[5] * (first - 1)) + 1, MIN_DIFFICULTY, MAX_DIFFICULTY)
+
+    for position in range(1, ratings.shape[1]):
+        n = int(active[position])
+        if not n:
+            break
+        rating = ratings[:n, position].astype(np.float64)
+        days = elapsed[:n, position]
+        s, d = stability[:, :n], difficulty[:, :n]
+
+        retrievability = (1 + factor * days / s) ** decay
+        long_term = days >= 1
+        if long_term.any():
+            predicted = np.clip(retrievability[:, long_term], EPSILON, 1 - EPSILON)
+            recalled = rating[long_term] > 1
+            log_loss -= np.where(recalled, np.log(predicted), np.log(1 - predicted)).sum(axis=1)
+            squared_error += ((predicted - recalled) ** 2).sum(axis=1)
+            count += int(long_term.sum())
+
+        short_term = s * np.exp(w[17] * (rating - 3 + w[18])) * s ** -w[19]
+        short_term = np.where(rating >= 3, np.maximum(short_term, s), short_term)
+        recall = s * (
+            1 + np.exp(w[8]) * (11 - d) * s ** -w[9] * np.expm1((1 - retrievability) * w[10])
+            * np.where(rating == 2, w[15], 1) * np.where(rating == 4, w[16], 1)
+        )
+        forget = np.minimum(
+            w[11] * d ** -w[12] * ((s + 1) ** w[13] - 1) * np.exp((1 - retrievability) * w[14]),
+            s / short_term_forget,
+        )
+        long_term_stability = np.where(rating == 1, forget, recall)
+        stability[:, :n] = np.maximum(np.where(long_term, long_term_stability, short_term), STABILITY_MIN)
+
+        damped = d + (10 - d) * (-w[6] * (rating - 3)) / 9
+        difficulty[:, :n] = np.clip(w[7] * easy_difficulty + (1 - w[7]) * damped, MIN_DIFFICULTY, MAX_DIFFICULTY)
+
+    return log_loss, squared_error, count
+
+
+def evaluate(parameters: np.ndarray, packed: dict) -> tuple:
+    """
+    Log-loss and RMSE of each parameter set over a whole packed history, in chunks of cards.
+    Returns:
+        tuple: Mean log-loss and RMSE arrays, one value per parameter set.
+    """
+    parameters = np.atleast_2d(parameters)
+    log_loss, squared_error, count = np.zeros(len(parameters)), np.zeros(len(parameters)), 0
+    for start in range(0, len(packed["ratings"]), EVAL_CARDS):
+        rows = slice(start, start + EVAL_CARDS)
+        active = np.clip(packed["active"] - start, 0, EVAL_CARDS)
+        chunk = replay(parameters, packed["ratings"][rows], packed["elapsed"][rows], active)
+        log_loss += chunk[0]
+        squared_error += chunk[1]
+        count += chunk[2]
+    count = max(count, 1)
+    return log_loss / count, np.sqrt(squared_error / count)
+
+
+def batches(packed: dict, batch_reviews: int) -> list:
+    """Consecutive runs of cards with about batch_reviews predicted reviews each, as row slices"""
+    per_card = (packed["elapsed"][:, 1:] >= 1).sum(axis=1)
+    cumulative = np.cumsum(per_card)
+    edges = np.searchsorted(cumulative, np.arange(batch_reviews, cumulative[-1], batch_reviews))
+    edges = np.unique(np.r_[0, edges + 1, len(per_card)])
+    return [slice(int(start), int(end)) for start, end in zip(edges[:-1], edges[1:])]
+
+
+def gradient(parameters: np.ndarray, packed: dict, rows: slice) -> tuple:
+    """
+    Central difference gradient of the mean log-loss, all 2 x 21 neighbours replayed in one batch.
+    Returns:
+        tuple: The loss at parameters and its gradient, or (None, None) for a batch with nothing to predict.
+    """
+    size = len(parameters)
+    step = 1e-4 * np.maximum(1.0, np.abs(parameters))
+    upper = np.minimum(parameters + step, UPPER)
+    lower = np.maximum(parameters - step, LOWER)
+
+    points = np.repeat(parameters[None, :], 1 + 2 * size, axis=0)
+    points[1 + np.arange(size), np.arange(size)] = upper
+    points[1 + size + np.arange(size), np.arange(size)] = lower
+
+    active = np.clip(packed["active"] - rows.start, 0, rows.stop - rows.start)
+    log_loss, _, count = replay(points, packed["ratings"][rows], packed["elapsed"][rows], active)
+    if not count:
+        return None, None
+    log_loss /= count
+    return log_loss[0], (log_loss[1:1 + size] - log_loss[1 + size:]) / (upper - lower)
+
+
+def fit(packed: dict, initial: tuple = DEFAULT_PARAMETERS, seed: int = 42) -> dict:
+    """
+    Fit FSRS parameters to a packed history: Adam on mini-batches of cards with cosine learning
+    rate decay, parameters kept within the Scheduler's bounds. The parameters of the best epoch
+    are kept, the initial ones included, so the fit is never worse on this history.
+    Args:
+        packed (dict): Output of pack().
+        initial (tuple): Starting parameters, the FSRS defaults.
+        seed (int): Seed of the batch order.
+    Returns:
+        dict: parameters, reviews, cards, log_loss and rmse before (initial) and after, seconds taken.
+    """
+    started = time.perf_counter()
+    initial = np.array(initial, dtype=np.float64)
+    before = evaluate(initial, packed)
+    best = {"parameters": initial, "log_loss": before[0][0], "rmse": before[1][0]}
+
+    if packed["reviews"]:
+        rng = np.random.default_rng(seed)
+        parts = batches(packed, max(BATCH_REVIEWS, math.ceil(packed["reviews"] / MAX_STEPS)))
+        total_steps, steps = len(parts) * EPOCHS, 0
+        parameters = initial.copy()
+        moment, velocity = np.zeros_like(parameters), np.zeros_like(parameters)
+
+        for _ in range(EPOCHS):
+            for index in rng.permutation(len(parts)):
+                _, grad = gradient(parameters, packed, parts[index])
+                steps += 1
+                if grad is None:
+                    continue
+                rate = LEARNING_RATE * 0.5 * (1 + math.cos(math.pi * steps / total_steps))
+                moment = 0.9 * moment + 0.1 * grad
+                velocity = 0.999 * velocity + 0.001 * grad ** 2
+                corrected = moment / (1 - 0.9 ** steps), velocity / (1 - 0.999 ** steps)
+                parameters = np.clip(parameters - rate * corrected[0] / (np.sqrt(corrected[1]) + 1e-8), LOWER, UPPER)
+
+            log_loss, rmse = evaluate(parameters, packed)
+            if log_loss[0] < best["log_loss"]:
+                best = {"parameters": parameters.copy(), "log_loss": log_loss[0], "rmse": rmse[0]}
+
+    return {
+        "parameters": [round(float(value), 6) for value in best["parameters"]],
+        "reviews": packed["reviews"],
+        "cards": len(packed["ratings"]),
+        "log_loss_default": float(before[0][0]),
+        "log_loss": float(best["log_loss"]),
+        "rmse_default": float(before[1][0]),
+        "rmse": float(best["rmse"]),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def validate(train: dict, test: dict, full: dict, initial: tuple = DEFAULT_PARAMETERS, seed: int = 42) -> dict:
+    """
+    Fit on the training cards and score the fit against the initial parameters on the held-out
+    cards. When it predicts them better, refit on every card for the parameters to use.
+    Args:
+        train, test, full (dict): pack() of the training cards, the held-out cards and all of them.
+        initial (tuple): Starting parameters, the FSRS defaults.
+        seed (int): Seed of the batch order.
+    Returns:
+        dict: parameters (of the refit, None when the fit doesn't beat the initial parameters),
+            reviews and cards (all), holdout_reviews, held-out log_loss and rmse of the initial
+            parameters and of the fit, seconds taken.
+    """
+    started = time.perf_counter()
+    trained = fit(train, initial, seed)
+    log_loss, rmse = evaluate(np.array([initial, trained["parameters"]], dtype=np.float64), test)
+    improved = test["reviews"] > 0 and log_loss[1] < log_loss[0]
+
+    return {
+        "parameters": fit(full, initial, seed)["parameters"] if improved else None,
+        "reviews": full["reviews"],
+        "cards": len(full["ratings"]),
+        "holdout_reviews": test["reviews"],
+        "log_loss_default": float(log_loss[0]),
+        "log_loss": float(log_loss[1]),
+        "rmse_default": float(rmse[0]),
+        "rmse": float(rmse[1]),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+def to_isoformat(value: Optional[Union[datetime, str]]) -> Optional[str]:
+    """
+    Datetime column value as an isoformat string.
+    Sqlite returns tz aware timestamps as strings and naive ones as datetime, naive ones are taken as UTC.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+def format_interval(seconds: int) -> str:
+    """Short label for an interval: 45s, 10m, 3h, 4d, 2mo, 1.5y"""
+    if seconds < 60:
+        return f"{max(seconds, 0)}s"
+    if seconds < 3600:
+        return f"{round(seconds / 60)}m"
+    if seconds < 86400:
+        return f"{round(seconds / 3600)}h"
+    days = seconds / 86400
+    if days < 30:
+        return f"{round(days)}d"
+    if days < 365:
+        return f"{round(days / 30)}mo"
+    return f"{round(days / 365, 1)}y"
+
+def now_iso() -> str:
+    """
+    Current UTC time formatted like the stored due/last_review values (FSRS isoformat),
+    compare due columns against this rather than datetime.now(), they are stored as text.
+    """
+    return datetime.now(timezone.utc).isoformat()
+
+def to_timestamp(value: Optional[Union[datetime, str]]) -> Optional[float]:
+    """Epoch seconds of a datetime column value, naive values are taken as UTC"""
+    value = to_isoformat(value)
+    return datetime.fromisoformat(value).timestamp() if value else None
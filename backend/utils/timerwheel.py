@@ -0,0 +1,77 @@
+"""
+Hierarchical timer wheel
+
+Level 0 has one slot per tick, each level above has slots spanning `slots` times more ticks.
+A timer is filed in the lowest level that reaches its deadline, and is moved down a level
+(cascaded) when the wheel below wraps around to it. Adding a timer and firing a tick cost
+O(1) whatever the number of timers, unlike a heap or polling every deadline.
+"""
+
+from typing import Any, Optional
+
+
+class TimerWheel:
+    """
+    Args:
+        start (float): Time (seconds) the wheel starts at
+        tick (float): Seconds per tick, the timer resolution
+        slots (int): Slots per level
+        levels (int): Number of levels, deadlines beyond slots**levels ticks wait in an overflow list
+    """
+
+    def __init__(self, start: float, tick: float = 1.0, slots: int = 64, levels: int = 4):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = int(start // tick)
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.overflow = []
+        self.expired = []
+
+    def add(self, deadline: float, item: Any) -> None:
+        """Schedule item to be returned by advance() once deadline has passed"""
+        self._file(int(deadline // self.tick), item)
+
+    def _file(self, expires: int, item: Any) -> None:
+        delta = expires - self.current
+        if delta <= 0:
+            self.expired.append(item)
+            return
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1):
+                slot = (expires // self.slots ** level) % self.slots
+                self.wheels[level][slot].append((expires, item))
+                return
+        self.overflow.append((expires, item))
+
+    def _cascade(self) -> None:
+        # Highest level first, its timers may land in lower level slots cascaded next
+        if self.current % self.slots ** self.levels == 0:
+            overflow, self.overflow = self.overflow, []
+            for expires, item in overflow:
+                self._file(expires, item)
+        for level in range(self.levels - 1, 0, -1):
+            span = self.slots ** level
+            if self.current % span == 0:
+                slot = (self.current // span) % self.slots
+                timers, self.wheels[level][slot] = self.wheels[level][slot], []
+                for expires, item in timers:
+                    self._file(expires, item)
+
+    def advance(self, now: float) -> list:
+        """
+        Move the wheel to now
+        Returns:
+            list: Items whose deadline passed, in deadline order per tick
+        """
+        target = int(now // self.tick)
+        fired, self.expired = self.expired, []
+        while self.current < target:
+            self.current += 1
+            self._cascade()
+            slot = self.current % self.slots
+            timers, self.wheels[0][slot] = self.wheels[0][slot], []
+            fired.extend(item for _, item in timers)
+            fired.extend(self.expired)
+            self.expired = []
+        return fired